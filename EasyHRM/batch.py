@@ -0,0 +1,228 @@
+"""Run pattern detection and data analysis over whole study directories without the GUI.
+
+Usage: python EasyHRM/batch.py settings.json <directory, file or glob> ... [--workers N] [--output DIR]
+
+Text recordings (.txt) are detected to <name>_detected.seq and plotHRM exports (.xlsx) are
+analysed to <name>_analysis.xlsx, next to the input or in --output. With "analyse_detected"
+set, recordings are also analysed straight from their detected patterns. Inputs that would
+write the same result file are reported and nothing is processed.
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils import convertTime, validateTime
+from patternDetectionScreen.detector import PatternDetector
+import exportToExcelScreen.export as analysis
+from exportToExcelScreen.detected import detected_sequence_table
+from exportToExcelScreen.importFile import read_plothrm_export
+
+# Same defaults as the Pattern Detection and Data Analysis screens
+DEFAULT_SETTINGS = {
+    "visible_sensors": [1, 80],
+    "start_time": "00:00:00",
+    "detection_threshold": 100,
+    "min_pattern_length": 3,
+    "zone_threshold": 100,
+    "distance_between_sensors": 25,
+    "broken_sensors": [],
+    "regions": [[1, 16], [17, 32], [33, 48], [49, 64], [65, 80]],
+    "disabled_regions": [],
+    "first_event": "Post-Wake",
+    "events": {},
+    "pattern_parameters": {"long_sensors": 5, "hapc_sensors": 5, "hapc_consecutive": 3, "hapc_amplitude": 100},
+    "analyse_detected": False,
+}
+
+RECORDING_EXTENSIONS = (".txt",)
+ANALYSIS_EXTENSIONS = (".xlsx", ".xls")
+
+
+def load_settings(path):
+    """Read a JSON settings file, missing keys fall back to the GUI defaults"""
+    with open(path, 'r', encoding='utf-8') as file:
+        settings = json.load(file)
+
+    unknown = set(settings) - set(DEFAULT_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+
+    merged = dict(DEFAULT_SETTINGS)
+    merged.update(settings)
+    merged["pattern_parameters"] = {**DEFAULT_SETTINGS["pattern_parameters"], **settings.get("pattern_parameters", {})}
+
+    for time_string in [merged["start_time"], *merged["events"]]:
+        if not validateTime(time_string):
+            raise ValueError(f"Invalid time '{time_string}', expected HH:MM:SS")
+    return merged
+
+
+def is_output_file(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name.endswith("_analysis") or name.startswith("~$")
+
+
+def collect_inputs(patterns):
+    """Expand directories and globs into the recordings and plotHRM exports to process"""
+    inputs = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(pattern, name) for name in sorted(os.listdir(pattern))]
+        else:
+            matches = sorted(glob.glob(pattern)) or [pattern]
+
+        for path in matches:
+            extension = os.path.splitext(path)[1].lower()
+            if os.path.isfile(path) and extension in RECORDING_EXTENSIONS + ANALYSIS_EXTENSIONS and not is_output_file(path):
+                if path not in inputs:
+                    inputs.append(path)
+    return inputs
+
+
+def output_path(path, output_dir, suffix):
+    directory = output_dir or os.path.dirname(os.path.abspath(path))
+    base_name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(directory, f"{base_name}{suffix}")
+
+
+def output_paths(path, settings, output_dir):
+    """Files process_file writes for one input"""
+    if os.path.splitext(path)[1].lower() not in RECORDING_EXTENSIONS:
+        return [output_path(path, output_dir, "_analysis.xlsx")]
+    paths = [output_path(path, output_dir, "_detected.seq")]
+    if settings["analyse_detected"]:
+        paths.append(output_path(path, output_dir, "_analysis.xlsx"))
+    return paths
+
+
+def find_output_conflicts(inputs, settings, output_dir):
+    """Output files that more than one input would write, with those inputs"""
+    writers = {}
+    for path in inputs:
+        for output in output_paths(path, settings, output_dir):
+            writers.setdefault(os.path.normcase(os.path.abspath(output)), []).append(path)
+    return {output: paths for output, paths in writers.items() if len(paths) > 1}
+
+
+def detect_recording(path, settings, output_dir, parallel=True):
+    """Detect the patterns of one recording and write them to a .seq file, and analyse them when asked"""
+    detector = PatternDetector(
+        path,
+        visible_sensors=tuple(settings["visible_sensors"]),
+        detection_threshold=int(settings["detection_threshold"]),
+        zone_threshold=int(settings["zone_threshold"]),
+        min_pattern_length=int(settings["min_pattern_length"]),
+        distance_between_sensors=int(settings["distance_between_sensors"]),
+        start_seconds=round(convertTime(settings["start_time"]) / 10),
+        broken_sensors=[int(sensor) for sensor in settings["broken_sensors"]],
+        # Files are already spread over the batch workers
+        workers=None if parallel else 1,
+    )
+    detector.detect()
+    save_path = detector.export(output_path(path, output_dir, "_detected.seq"))
+    if not settings["analyse_detected"]:
+        return save_path
+
+    # The analysis skips the plotHRM export and reads the detected patterns directly
+    columns = detector.sensor_columns()
+    data = detected_sequence_table(detector.result, detector.distance_between_sensors, columns.stop - columns.start, path)
+    return f"{save_path}, {analyse_data(data, settings, output_path(path, output_dir, '_analysis.xlsx'), parallel)}"
+
+
+def analyse_export(path, settings, output_dir, parallel=True):
+    """Build the analysis workbook of one plotHRM export"""
+    data = read_plothrm_export(path)
+    return analyse_data(data, settings, output_path(path, output_dir, "_analysis.xlsx"), parallel)
+
+
+def analyse_data(data, settings, save_path, parallel=True):
+    """Build the analysis workbook of a plotHRM sequence table and save it"""
+    analysis.reset_disabled_sections()
+    for region in settings["disabled_regions"]:
+        analysis.add_disabled_sections(region)
+
+    sliders = [analysis.SettingSnapshot(region) for region in settings["regions"]]
+    settings_sliders = [analysis.SettingSnapshot(settings["distance_between_sensors"])]
+    pattern_params = {key: analysis.SettingSnapshot(str(value)) for key, value in settings["pattern_parameters"].items()}
+    events = {convertTime(time_string): name for time_string, name in settings["events"].items()}
+
+    # Files are already spread over the batch workers
+    wb = analysis.build_analysis_workbook(data, sliders, events, settings["first_event"], settings_sliders, pattern_params,
+                                          workers=None if parallel else 1)
+    wb.save(save_path)
+    return save_path
+
+
+def process_file(path, settings, output_dir, parallel=True):
+    if os.path.splitext(path)[1].lower() in RECORDING_EXTENSIONS:
+        return detect_recording(path, settings, output_dir, parallel)
+    return analyse_export(path, settings, output_dir, parallel)
+
+
+def run_batch(inputs, settings, output_dir=None, workers=None):
+    """Process all inputs on a pool of worker processes, returns the paths that failed"""
+    workers = max(1, min(workers or os.cpu_count() or 1, len(inputs)))
+    failed = []
+
+    if workers == 1:
+        for path in inputs:
+            try:
+                print(f"{path} -> {process_file(path, settings, output_dir)}")
+            except Exception as e:
+                print(f"Error processing {path}: {e}")
+                failed.append(path)
+        return failed
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_file, path, settings, output_dir, False): path for path in inputs}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                print(f"{path} -> {future.result()}")
+            except Exception as e:
+                print(f"Error processing {path}: {e}")
+                failed.append(path)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect and analyse recordings without the GUI.")
+    parser.add_argument("settings", help="JSON settings file")
+    parser.add_argument("inputs", nargs="+", help="directories, files or glob patterns of recordings (.txt) and plotHRM exports (.xlsx)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--output", default=None, help="directory for the results (default: next to each input)")
+    args = parser.parse_args(argv)
+
+    try:
+        settings = load_settings(args.settings)
+    except (OSError, ValueError) as e:
+        print(f"Error reading settings: {e}")
+        return 2
+
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("No recordings or plotHRM exports found.")
+        return 1
+
+    # Inputs writing the same file would overwrite each other's results, whichever finishes last
+    conflicts = find_output_conflicts(inputs, settings, args.output)
+    if conflicts:
+        for output, paths in conflicts.items():
+            print(f"Error: {', '.join(paths)} would write the same file {output}")
+        return 2
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    failed = run_batch(inputs, settings, args.output, args.workers)
+    print(f"Processed {len(inputs) - len(failed)} of {len(inputs)} files")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
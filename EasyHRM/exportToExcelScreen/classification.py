@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+from regions import REGIONS
+
+HEADER_NAMES = ['Sequence', 'Hour', 'Minute', 'Second', 'Sample']
+
+# Columns of the plotHRM sequence table, sensor n is column n + SENSOR_COLUMN_OFFSET
+SEQUENCE_COLUMN = 0
+DIRECTION_COLUMN = 5
+VELOCITY_COLUMN = 6
+LENGTH_COLUMN = 9
+START_REGION_COLUMN = 10
+SENSOR_COLUMN_OFFSET = 10
+
+# What a row of the sequence table is
+SKIPPED = 0
+EVENT_MARKER = 1
+SEQUENCE = 2
+
+DEFAULT_PATTERN_PARAMETERS = {
+    'LONG_PATTERN_MINIMUM_SENSORS': 5,
+    'HAPC_PATTERN_MINIMUM_SENSORS': 5,
+    'HIGH_AMPLITUDE_MINIMUM_PATTERN_LENGTH': 3,
+    'HIGH_AMPLITUDE_MINIMUM_VALUE': 100
+}
+
+def cell_value(value):
+    """The value a DataFrame entry ends up as in the analysis sheet"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        if np.isnan(value):
+            return None
+        if np.isinf(value):
+            # pandas writes infinities as text
+            return "inf" if value > 0 else "-inf"
+    if value is None or (isinstance(value, str) and value == "") or value is pd.NA or value is pd.NaT:
+        return None
+    return value
+
+def column_cells(data, column):
+    if column >= data.shape[1]:
+        return [None] * len(data)
+    return [cell_value(value) for value in data.iloc[:, column].tolist()]
+
+def numeric_cells(data, column):
+    """Values of a column as floats, NaN where the sheet cell holds no number"""
+    if column >= data.shape[1]:
+        return np.full(len(data), np.nan)
+    values = data.iloc[:, column]
+    if values.dtype.kind in "biuf":
+        numbers = values.to_numpy(dtype=np.float64)
+        return np.where(np.isfinite(numbers), numbers, np.nan)
+    return np.array([float(value) if isinstance(value, (int, float)) else np.nan
+                     for value in map(cell_value, values.tolist())], dtype=np.float64)
+
+def is_event_marker(value):
+    return isinstance(value, str) and value != "" and not value.isdigit() and value not in HEADER_NAMES
+
+def row_kind(first_value, start_region):
+    if not first_value:
+        return SKIPPED
+    if is_event_marker(first_value):
+        return EVENT_MARKER
+    if isinstance(first_value, str) and first_value in HEADER_NAMES:
+        return SKIPPED
+    # Rows with a named start region are not sequences
+    if start_region and isinstance(start_region, str) and not start_region.replace('.', '').replace('-', '').isdigit():
+        return SKIPPED
+    return SEQUENCE
+
+def parse_direction(value):
+    if value is None:
+        return ''
+    direction = str(value).strip()
+    if direction in ['a', 'r', 's']:
+        return direction
+    for char in direction.lower():
+        if char in ['a', 'r', 's']:
+            return char
+    return ''
+
+def parse_velocity(value):
+    if value is None:
+        return 0.0
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+def parse_length(value):
+    """Number of sensors of a sequence and whether it may be counted, raises OverflowError for infinite lengths"""
+    if value is None:
+        return 0, True
+    try:
+        length = int(float(value))
+    except (ValueError, TypeError):
+        length = 0
+    try:
+        int(float(str(value)))
+        return length, True
+    except (ValueError, TypeError):
+        return length, False
+
+def any_active(active, start, end):
+    """Whether any sensor from start to end (both included) is active, per row"""
+    start = max(start, 1)
+    end = min(end, active.shape[1])
+    if end < start:
+        return np.zeros(active.shape[0], dtype=bool)
+    return active[:, start - 1:end].any(axis=1)
+
+def classify_sequences(data, region_map, params=None, sensor_count=36, first_row=0):
+    """Classify the rows of the plotHRM sequence table from first_row on, all at once.
+
+    Only the first sensor_count sensors of every row are looked at. Returns a dict of arrays
+    with one entry per row: kind (SKIPPED, EVENT_MARKER or SEQUENCE), marker (event name),
+    direction, velocity, is_long, is_hapc, is_harpc, starting_region, ending_region,
+    pan_colonic, counted (whether the row counts towards the pattern totals),
+    first_sensor and last_sensor (first and last active sensor, 0 if none), the amplitudes
+    matrix (NaN where a sensor holds no number) and the broken matrix (zero sensors
+    inside the sequence).
+    """
+    params = params or DEFAULT_PATTERN_PARAMETERS
+    data = data.iloc[first_row:]
+    rows = len(data)
+    sensor_count = max(sensor_count, 0)
+
+    first_values = column_cells(data, SEQUENCE_COLUMN)
+    start_regions = column_cells(data, START_REGION_COLUMN)
+    kind = np.array([row_kind(first, region) for first, region in zip(first_values, start_regions)], dtype=np.int8)
+    marker = [first.strip() if row == EVENT_MARKER else None for first, row in zip(first_values, kind.tolist())]
+
+    direction = np.array([parse_direction(value) for value in column_cells(data, DIRECTION_COLUMN)], dtype=object)
+    velocity = np.array([parse_velocity(value) for value in column_cells(data, VELOCITY_COLUMN)], dtype=np.float64)
+
+    length = np.zeros(rows, dtype=np.int64)
+    counted = np.ones(rows, dtype=bool)
+    for i, value in enumerate(column_cells(data, LENGTH_COLUMN)):
+        if kind[i] != SEQUENCE:
+            continue
+        try:
+            length[i], counted[i] = parse_length(value)
+        except OverflowError:
+            kind[i] = SKIPPED
+
+    amplitudes = np.column_stack([numeric_cells(data, sensor + SENSOR_COLUMN_OFFSET)
+                                  for sensor in range(1, sensor_count + 1)]) if sensor_count else np.empty((rows, 0))
+    active = amplitudes > 0
+    has_active = active.any(axis=1)
+    first_sensor = np.where(has_active, active.argmax(axis=1) + 1, 0)
+    last_sensor = np.where(has_active, sensor_count - active[:, ::-1].argmax(axis=1), 0)
+
+    sensors = np.arange(1, sensor_count + 1)
+    inside = (sensors >= first_sensor[:, None]) & (sensors <= last_sensor[:, None])
+    broken = inside & (amplitudes == 0)
+
+    high_amplitude_count = (amplitudes >= params['HIGH_AMPLITUDE_MINIMUM_VALUE']).sum(axis=1)
+    is_high_amplitude = high_amplitude_count >= params['HIGH_AMPLITUDE_MINIMUM_PATTERN_LENGTH']
+    hapc_length = length >= params['HAPC_PATTERN_MINIMUM_SENSORS']
+    is_hapc = is_high_amplitude & (direction == 'a') & hapc_length
+    is_harpc = is_high_amplitude & (direction == 'r') & hapc_length
+    is_long = length >= params['LONG_PATTERN_MINIMUM_SENSORS']
+
+    starting_region = region_map.starting_regions(first_sensor)
+    ending_region = region_map.ending_regions(last_sensor)
+
+    # Pan-colonic patterns are active in the rectum and in the region they start in
+    slider_values = region_map.slider_values
+    pan_colonic = np.zeros(rows, dtype=bool)
+    if len(slider_values) >= 5:
+        rectum_start, rectum_end = slider_values[4]
+        rectum_active = any_active(active, rectum_start, rectum_end)
+        for i, region in enumerate(REGIONS):
+            start, end = slider_values[i]
+            starts_here = starting_region == region
+            pan_colonic[starts_here] = rectum_active[starts_here] & any_active(active[starts_here], start, end)
+
+    return {
+        'kind': kind,
+        'marker': marker,
+        'direction': direction,
+        'velocity': velocity,
+        'is_long': is_long,
+        'is_hapc': is_hapc,
+        'is_harpc': is_harpc,
+        'starting_region': starting_region,
+        'ending_region': ending_region,
+        'pan_colonic': pan_colonic,
+        'counted': counted,
+        'first_sensor': first_sensor,
+        'last_sensor': last_sensor,
+        'amplitudes': amplitudes,
+        'broken': broken,
+    }
@@ -0,0 +1,224 @@
+import numpy as np
+from regions import REGIONS
+
+# Pattern types in the order of the direction codes below, "Long "/"Short " have no direction
+PATTERN_TYPES = ["Long s", "Short s", "Long r", "Short r", "Long a", "Short a", "Long ", "Short "]
+DIRECTION_CODES = {'s': 0, 'r': 1, 'a': 2, '': 3}
+# Pan-colonic patterns from every region but the rectum
+REGION_RANGES = ["Ascending - Rectum", "Transverse - Rectum", "Descending - Rectum", "Sigmoid-Rectum"]
+SPECIAL_PATTERNS = ['cyclic s', 'cyclic r', 'cyclic a', 'HAPCs', 'HARPCs']
+
+# Buckets of one event: every region, region range and the total of every pattern type, then the specials
+REGION_KEYS = REGIONS + REGION_RANGES + ['Total']
+TOTAL_KEY = len(REGION_KEYS) - 1
+FIRST_SPECIAL_BUCKET = len(PATTERN_TYPES) * len(REGION_KEYS)
+BUCKETS_PER_EVENT = FIRST_SPECIAL_BUCKET + len(SPECIAL_PATTERNS)
+
+
+def bucket_index(pattern_type, region_key):
+    if pattern_type in SPECIAL_PATTERNS:
+        return FIRST_SPECIAL_BUCKET + SPECIAL_PATTERNS.index(pattern_type)
+    if pattern_type not in PATTERN_TYPES or region_key not in REGION_KEYS:
+        return None
+    return PATTERN_TYPES.index(pattern_type) * len(REGION_KEYS) + REGION_KEYS.index(region_key)
+
+
+def sequence_table(classified, sequences, intervals):
+    """One entry per classified sequence: (event interval, pattern type, starting region, pan-colonic range or -1,
+    is HAPC, is HARPC, velocity, amplitude count, sum, min and max)"""
+    directions = [DIRECTION_CODES[direction] for direction in classified['direction'][sequences].tolist()]
+    pattern = 2 * np.array(directions, dtype=np.int64) + ~classified['is_long'][sequences]
+    region = np.array([REGIONS.index(name) for name in classified['starting_region'][sequences].tolist()],
+                      dtype=np.int64)
+    region_range = np.where(classified['pan_colonic'][sequences] & (region < len(REGION_RANGES)), region, -1)
+
+    amplitudes = classified['amplitudes'][sequences]
+    missing = np.isnan(amplitudes)
+    return {
+        'interval': intervals,
+        'pattern': pattern,
+        'region': region,
+        'region_range': region_range,
+        'is_hapc': classified['is_hapc'][sequences],
+        'is_harpc': classified['is_harpc'][sequences] & ~classified['is_hapc'][sequences],
+        'velocity': classified['velocity'][sequences],
+        'amplitude_count': (~missing).sum(axis=1),
+        'amplitude_sum': np.where(missing, 0.0, amplitudes).sum(axis=1),
+        'amplitude_min': np.where(missing, np.inf, amplitudes).min(axis=1, initial=np.inf),
+        'amplitude_max': np.where(missing, -np.inf, amplitudes).max(axis=1, initial=-np.inf),
+    }
+
+
+class RunningStatistics:
+    """Count, sum, min and max of the values of every bucket, kept up to date without the values themselves.
+
+    Statistics of the same buckets merge in constant time per bucket, whatever they were built from.
+    """
+
+    def __init__(self, size):
+        self.count = np.zeros(size, dtype=np.int64)
+        self.total = np.zeros(size)
+        self.minimum = np.full(size, np.inf)
+        self.maximum = np.full(size, -np.inf)
+
+    def add(self, buckets, values):
+        """Add one value per entry of buckets"""
+        self.add_summaries(buckets, np.ones(len(values), dtype=np.int64), values, values, values)
+
+    def add_summaries(self, buckets, count, total, minimum, maximum):
+        """Add groups of values given by their count, sum, min and max"""
+        self.count += np.bincount(buckets, weights=count, minlength=len(self.count)).astype(np.int64)
+        np.add.at(self.total, buckets, total)
+        np.minimum.at(self.minimum, buckets, minimum)
+        np.maximum.at(self.maximum, buckets, maximum)
+
+    def merge(self, other, offset=0):
+        """Merge the buckets of other into the buckets of self from offset on"""
+        buckets = slice(offset, offset + len(other.count))
+        self.count[buckets] += other.count
+        self.total[buckets] += other.total
+        np.minimum(self.minimum[buckets], other.minimum, out=self.minimum[buckets])
+        np.maximum(self.maximum[buckets], other.maximum, out=self.maximum[buckets])
+        return self
+
+    def regroup(self, targets, size):
+        """Statistics of size buckets where bucket targets[i] merges bucket i, buckets with a negative target are left out"""
+        keep = targets >= 0
+        grouped = RunningStatistics(size)
+        grouped.add_summaries(targets[keep], self.count[keep], self.total[keep], self.minimum[keep], self.maximum[keep])
+        return grouped
+
+    def merge_groups(self, target, sources):
+        """Merge the buckets of each row of sources (a 2d index array) into the matching target bucket"""
+        self.count[target] = self.count[sources].sum(axis=1)
+        self.total[target] = self.total[sources].sum(axis=1)
+        self.minimum[target] = self.minimum[sources].min(axis=1)
+        self.maximum[target] = self.maximum[sources].max(axis=1)
+
+    def summary(self, index):
+        """(min, max, mean) of a bucket, None if it holds no values"""
+        count = self.count[index]
+        if not count:
+            return None
+        return float(self.minimum[index]), float(self.maximum[index]), float(self.total[index] / count)
+
+
+class SequenceStatistics:
+    """Number of sequences and running statistics of their velocities and amplitudes, per bucket"""
+
+    def __init__(self, size):
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.velocities = RunningStatistics(size)
+        self.amplitudes = RunningStatistics(size)
+
+    def merge(self, other, offset=0):
+        """Merge the buckets of other into the buckets of self from offset on"""
+        self.counts[offset:offset + len(other.counts)] += other.counts
+        self.velocities.merge(other.velocities, offset)
+        self.amplitudes.merge(other.amplitudes, offset)
+        return self
+
+    def regroup(self, targets, size):
+        """Statistics of size buckets where bucket targets[i] merges bucket i, see RunningStatistics.regroup"""
+        keep = targets >= 0
+        grouped = SequenceStatistics(size)
+        grouped.counts += np.bincount(targets[keep], weights=self.counts[keep], minlength=size).astype(np.int64)
+        grouped.velocities = self.velocities.regroup(targets, size)
+        grouped.amplitudes = self.amplitudes.regroup(targets, size)
+        return grouped
+
+
+def interval_statistics(classified, sequences, interval_total):
+    """Statistics of the sequences of every event interval, BUCKETS_PER_EVENT buckets per interval.
+
+    sequences are indices into the classified arrays. Every sequence counts towards the region
+    it starts in and, when pan-colonic, towards its region range; HAPCs and HARPCs also get a
+    bucket of their own. The totals are left to ComprehensiveStatistics.
+    """
+    table = sequence_table(classified, sequences, classified['interval'][sequences])
+    rows = np.arange(len(table['interval']))
+    first_bucket = table['interval'] * BUCKETS_PER_EVENT
+    pattern_bucket = first_bucket + table['pattern'] * len(REGION_KEYS)
+    pan_colonic = rows[table['region_range'] >= 0]
+    hapcs = rows[table['is_hapc']]
+    harpcs = rows[table['is_harpc']]
+
+    buckets = np.concatenate([
+        pattern_bucket + table['region'],
+        pattern_bucket[pan_colonic] + len(REGIONS) + table['region_range'][pan_colonic],
+        first_bucket[hapcs] + bucket_index('HAPCs', None),
+        first_bucket[harpcs] + bucket_index('HARPCs', None),
+    ]).astype(np.int64)
+    members = np.concatenate([rows, pan_colonic, hapcs, harpcs])
+
+    statistics = SequenceStatistics(interval_total * BUCKETS_PER_EVENT)
+    statistics.counts += np.bincount(buckets, minlength=len(statistics.counts))
+    # Sequences without velocity are counted but left out of the velocity statistics
+    velocity = table['velocity'][members]
+    moving = velocity != 0
+    statistics.velocities.add(buckets[moving], velocity[moving])
+    statistics.amplitudes.add_summaries(buckets, table['amplitude_count'][members], table['amplitude_sum'][members],
+                                        table['amplitude_min'][members], table['amplitude_max'][members])
+    return statistics
+
+
+class ComprehensiveStatistics:
+    """Statistics behind the comprehensive table, merged from the statistics of the event intervals.
+
+    The intervals counted for the same event are merged into the buckets of that event; the
+    total of a pattern type then merges its regions and region ranges. Only counts and
+    running statistics are kept per bucket, never the values.
+    """
+
+    def __init__(self, event_names, statistics, interval_events):
+        """statistics are the interval_statistics of all intervals, interval_events the name of the event of each"""
+        self.events = {}
+        for event in event_names:
+            self.events.setdefault(event, len(self.events))
+        size = len(self.events) * BUCKETS_PER_EVENT
+
+        # Intervals outside the known events are left out
+        event_ids = np.array([self.events.get(event, -1) for event in interval_events], dtype=np.int64)
+        targets = event_ids[:, None] * BUCKETS_PER_EVENT + np.arange(BUCKETS_PER_EVENT)
+        targets = np.where(event_ids[:, None] >= 0, targets, -1).reshape(-1)
+        statistics = statistics.regroup(targets, size)
+        self.counts = statistics.counts
+        self.velocities = statistics.velocities
+        self.amplitudes = statistics.amplitudes
+
+        # The total of a pattern type merges its regions and region ranges
+        event_buckets = np.arange(len(self.events))[:, None, None] * BUCKETS_PER_EVENT
+        pattern_buckets = event_buckets + np.arange(len(PATTERN_TYPES))[None, :, None] * len(REGION_KEYS)
+        sources = (pattern_buckets + np.arange(TOTAL_KEY)).reshape(-1, TOTAL_KEY)
+        target = (pattern_buckets + TOTAL_KEY).reshape(-1)
+        self.counts[target] = self.counts[sources].sum(axis=1)
+        self.velocities.merge_groups(target, sources)
+        self.amplitudes.merge_groups(target, sources)
+
+        # HAPCs and HARPCs are not counted again in the long antegrade and retrograde totals
+        count = self.counts
+        for event_id in self.events.values():
+            first = event_id * BUCKETS_PER_EVENT
+            for pattern_type, special in [("Long a", 'HAPCs'), ("Long r", 'HARPCs')]:
+                total = first + bucket_index(pattern_type, 'Total')
+                count[total] = max(0, count[total] - count[first + bucket_index(special, None)])
+
+    def bucket(self, event, pattern_type, region_key):
+        """Index of a bucket in the statistics arrays, None if the table has no such cell"""
+        if event not in self.events:
+            return None
+        local = bucket_index(pattern_type, region_key)
+        if local is None:
+            return None
+        return self.events[event] * BUCKETS_PER_EVENT + local
+
+    def count(self, event, pattern_type, region_key):
+        index = self.bucket(event, pattern_type, region_key)
+        return 0 if index is None else int(self.counts[index])
+
+    def summary(self, event, pattern_type, region_key):
+        """Count and (min, max, mean) of the velocities and amplitudes of a cell, None where there are none"""
+        index = self.bucket(event, pattern_type, region_key)
+        if index is None:
+            return 0, None, None
+        return int(self.counts[index]), self.velocities.summary(index), self.amplitudes.summary(index)
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+from sequences import ANTEGRADE, RETROGRADE, SYNCHRONOUS
+from utils import as_detected_sequences
+from exportToExcelScreen.classification import HEADER_NAMES
+
+# Rows of the plotHRM file header, the sequence table follows after one empty row
+FILE_HEADER = ['Data file:', 'Seq file:', 'Channels:', 'Samples:', 'Freq (Hz):', 'Options:', 'Height Res (mm/chan):',
+               'Synch. Bound (mm/s):', 'Regions:', 'Regions Start:', 'Regions End:']
+SEQUENCE_HEADER = HEADER_NAMES + ['Ant/Ret', 'Vel (mm/s)', 'Start Chan', 'End Chan', 'Length', 'Start Region']
+DIRECTION_LETTERS = {ANTEGRADE: 'a', RETROGRADE: 'r', SYNCHRONOUS: 's'}
+# Samples per second of the recordings
+SAMPLE_RATE = 10
+
+def detected_sequence_table(sequences, distance_between_sensors, channels=None, data_file=None):
+    """The detected sequences as the DataFrame pd.read_excel makes of their plotHRM export.
+
+    sequences is a DetectedSequences or the older list of patterns. Sensor n of the detection
+    (sensor_n, channel n - 2 of the .seq file) is channel n of the table, which has channels
+    sensor columns, by default up to the highest detected sensor. Directions and velocities
+    are the ones of the .seq file and start regions are left empty, as plotHRM does without
+    regions.
+    """
+    sequences = as_detected_sequences(sequences)
+    count = len(sequences)
+    sensors = sequences.channel + 2
+    if channels is None:
+        channels = int(sensors.max()) if len(sensors) else 0
+
+    head = len(FILE_HEADER) + 2
+    table = np.full((head + count, len(SEQUENCE_HEADER)), None, dtype=object)
+    table[:len(FILE_HEADER), 0] = FILE_HEADER
+    table[0, 1] = data_file
+    table[2, 1] = channels
+    table[4, 1] = float(SAMPLE_RATE)
+    table[6, 1] = float(distance_between_sensors)
+    table[8, 1] = 0
+    table[head - 1] = SEQUENCE_HEADER
+
+    # plotHRM rounds the start of a sequence to the nearest second
+    start_sample = sequences.start_sample()
+    hour, seconds = np.divmod((start_sample + SAMPLE_RATE // 2) // SAMPLE_RATE, 3600)
+    minute, second = np.divmod(seconds, 60)
+    velocity, direction = sequences.kinematics(distance_between_sensors)
+
+    rows = table[head:]
+    rows[:, 0] = list(range(1, count + 1))
+    for column, values in enumerate([hour, minute, second, start_sample], start=1):
+        rows[:, column] = values.tolist()
+    rows[:, 5] = [DIRECTION_LETTERS[code] for code in direction.tolist()]
+    rows[:, 6] = ["Infinity" if np.isinf(value) else value for value in velocity.tolist()]
+    rows[:, 7] = sensors[sequences.offsets[:-1]].tolist()
+    rows[:, 8] = sensors[sequences.offsets[1:] - 1].tolist()
+    rows[:, 9] = sequences.lengths().tolist()
+
+    # The peak of every sensor of a sequence goes in the column of that sensor
+    amplitudes = np.full((head + count, channels), np.nan)
+    amplitudes[head - 1] = np.arange(1, channels + 1)
+    peak_rows = head + np.repeat(np.arange(count), sequences.lengths())
+    inside = (sensors >= 1) & (sensors <= channels)
+    amplitudes[peak_rows[inside], sensors[inside] - 1] = sequences.value[inside]
+
+    data = pd.concat([pd.DataFrame(table), pd.DataFrame(amplitudes)], axis=1, ignore_index=True)
+    data.columns = ['Version:', 'EasyHRM'] + [''] * (data.shape[1] - 2)
+    return data
@@ -1,17 +1,49 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from bisect import bisect_left, bisect_right
 from tkinter import filedialog
+import numpy as np
 import pandas as pd
-from openpyxl import load_workbook
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
-from openpyxl.styles import Alignment, PatternFill
 from itertools import chain
+from utils import run_in_background, check_cancelled, TaskCancelled, show_info_popup
+from regions import RegionMap, REGIONS
+from exportToExcelScreen.classification import (classify_sequences, is_event_marker, cell_value,
+                                                 DEFAULT_PATTERN_PARAMETERS, EVENT_MARKER, SEQUENCE)
+from exportToExcelScreen.comprehensive import (ComprehensiveStatistics, SequenceStatistics, interval_statistics,
+                                                PATTERN_TYPES, REGION_RANGES, BUCKETS_PER_EVENT)
+from exportToExcelScreen.styles import (style_cell, EVENT_COLOR, HAPC_COLOR, HARPC_COLOR, HEADER_COLOR,
+                                        SENSOR_HEADER_COLOR, PATTERN_COLOR, ALTERNATING_EVENT_COLORS, REGION_COLORS,
+                                        PAN_COLONIC_COLORS)
 
 # Global constants
-EVENT_COLOR = "F0FC5A"
 disabled_sections = []
 HIGH_AMPLITUDE_MINIMUM_VALUE = 100
 HIGH_AMPLITUDE_MINIMUM_PATTERN_LENGTH = 3
 LONG_PATTERN_MINIMUM_SENSORS = 5
-ALTERNATING_EVENT_COLORS = ["F0FC5A", "FDE9D9"]
+
+# Analysis sheet layout: plotHRM rows from FIRST_MOVED_ROW on move down by MOVED_ROWS
+# to make room for the summary tables, and two columns (End Region and a spacer)
+# are inserted before the sensor columns.
+SHEET_NAME = "Sheet1"
+FIRST_MOVED_ROW = 13
+MOVED_ROWS = 12 + (71 - 25)
+SEQUENCE_HEADER_ROW = 72
+END_REGION_COLUMN = 12
+INSERTED_COLUMNS = 2
+# Rows from FIRST_CLASSIFIED_ROW on are classified, looking at the first LAST_CLASSIFIED_COLUMN columns
+FIRST_CLASSIFIED_ROW = 27
+LAST_CLASSIFIED_COLUMN = 49
+# Classified rows between two progress updates of a background export
+PROGRESS_ROW_INTERVAL = 500
+# Sequence tables from this many rows on are streamed into a write-only workbook
+WRITE_ONLY_MIN_ROWS = 5000
+# Sequence tables from this many rows on are classified on a process pool
+PARALLEL_MIN_ROWS = 50000
 
 def get_pattern_parameters(pattern_params):
     """Extract pattern parameters from GUI inputs with defaults"""
@@ -36,214 +68,6 @@ def get_pattern_parameters(pattern_params):
             'HIGH_AMPLITUDE_MINIMUM_VALUE': 100
         }
 
-def initialize_comprehensive_statistics(event_names):
-    """Initialize the comprehensive statistics structure for the new table"""
-    regions = ["Ascending", "Transverse", "Descending", "Sigmoid", "Rectum"]
-    pattern_types = ["Long s", "Short s", "Long r", "Short r", "Long a", "Short a", "Long ", "Short "]
-    region_ranges = ["Ascending - Rectum", "Transverse - Rectum", "Descending - Rectum", "Sigmoid-Rectum"]
-    
-    comprehensive_stats = {}
-    
-    for event in event_names:
-        comprehensive_stats[event] = {}
-        
-        for pattern_type in pattern_types:
-            comprehensive_stats[event][pattern_type] = {}
-            
-            for region in regions:
-                comprehensive_stats[event][pattern_type][region] = {
-                    'count': 0, 'velocities': [], 'amplitudes': []
-                }
-            
-            for region_range in region_ranges:
-                comprehensive_stats[event][pattern_type][region_range] = {
-                    'count': 0, 'velocities': [], 'amplitudes': []
-                }
-            
-            comprehensive_stats[event][pattern_type]['Total'] = {
-                'count': 0, 'velocities': [], 'amplitudes': []
-            }
-        
-        # Special categories
-        for special in ['cyclic s', 'cyclic r', 'cyclic a', 'HAPCs', 'HARPCs']:
-            comprehensive_stats[event][special] = {'count': 0, 'velocities': [], 'amplitudes': []}
-    
-    return comprehensive_stats
-
-def classify_pattern_enhanced(row, sliders, distance_between_sensors, params=None):
-    """Enhanced pattern classification with new rules and error handling"""
-    if params is None:
-        params = {
-            'LONG_PATTERN_MINIMUM_SENSORS': 5,
-            'HAPC_PATTERN_MINIMUM_SENSORS': 5,
-            'HIGH_AMPLITUDE_MINIMUM_PATTERN_LENGTH': 3,
-            'HIGH_AMPLITUDE_MINIMUM_VALUE': 100
-        }
-
-    try:
-        length_sensors = 0
-        if len(row) > 9 and row[9] and row[9].value is not None:
-            try:
-                length_sensors = int(float(row[9].value))
-            except (ValueError, TypeError):
-                length_sensors = 0
-        
-        direction = ''
-        if len(row) > 5 and row[5] and row[5].value is not None:
-            direction = str(row[5].value).strip()
-            if direction not in ['a', 'r', 's']:
-                for char in direction.lower():
-                    if char in ['a', 'r', 's']:
-                        direction = char
-                        break
-                else:
-                    direction = ''
-        
-        velocity = 0
-        if len(row) > 6 and row[6] and row[6].value is not None:
-            try:
-                velocity = float(row[6].value)
-            except (ValueError, TypeError):
-                velocity = 0
-        
-        is_long = (length_sensors >= params['LONG_PATTERN_MINIMUM_SENSORS'])
-        
-        amplitudes = []
-        for col_idx in range(13, min(len(row), 50)):
-            if (col_idx < len(row) and row[col_idx] and row[col_idx].value is not None and 
-                isinstance(row[col_idx].value, (int, float))):
-                amplitudes.append(float(row[col_idx].value))
-        
-        high_amp_count = count_high_amplitude_sensors(amplitudes, params['HIGH_AMPLITUDE_MINIMUM_VALUE'])
-        is_high_amplitude = (high_amp_count >= params['HIGH_AMPLITUDE_MINIMUM_PATTERN_LENGTH'])
-        is_hapc = is_high_amplitude and (direction == 'a') and (length_sensors >= params['HAPC_PATTERN_MINIMUM_SENSORS'])
-        is_harpc = is_high_amplitude and (direction == 'r') and (length_sensors >= params['HAPC_PATTERN_MINIMUM_SENSORS'])
-        
-        pattern_length_category = "Long" if is_long else "Short"
-        
-        return {
-            'length_category': pattern_length_category,
-            'direction': direction,
-            'velocity': velocity,
-            'amplitudes': amplitudes,
-            'is_hapc': is_hapc,
-            'is_harpc': is_harpc,
-            'starting_region': None
-        }
-        
-    except (ValueError, TypeError, IndexError):
-        return {
-            'length_category': "Short",
-            'direction': '',
-            'velocity': 0,
-            'amplitudes': [],
-            'is_hapc': False,
-            'is_harpc': False,
-            'starting_region': None
-        }
-
-def count_high_amplitude_sensors(amplitudes, threshold):
-    """Count total sensors above threshold (not necessarily consecutive)"""
-    if not amplitudes:
-        return 0
-    
-    count = 0
-    for amp in amplitudes:
-        if isinstance(amp, (int, float)) and amp >= threshold:
-            count += 1
-    
-    return count
-
-def determine_starting_region(row, sliders):
-    """Determine which colon region a pattern starts in based on first active sensor"""
-    try:
-        slider_values = getSliderValues(sliders)
-        if not slider_values:
-            return "Ascending"
-        
-        regions = ["Ascending", "Transverse", "Descending", "Sigmoid", "Rectum"]
-        
-        active_regions = []
-        active_sliders = []
-        for i, region in enumerate(regions):
-            if region not in disabled_sections and i < len(slider_values):
-                active_regions.append(region)
-                active_sliders.append(slider_values[i])
-        
-        if not active_regions:
-            return "Ascending"
-        
-        first_active_sensor = None
-        for col_idx in range(13, min(len(row), 50)):
-            if (col_idx < len(row) and row[col_idx] and row[col_idx].value is not None and 
-                isinstance(row[col_idx].value, (int, float)) and row[col_idx].value > 0):
-                first_active_sensor = col_idx - 12
-                break
-        
-        if first_active_sensor is None:
-            return active_regions[0]
-        
-        for i, (start_sensor, end_sensor) in enumerate(active_sliders):
-            if start_sensor <= first_active_sensor <= end_sensor:
-                return active_regions[i]
-
-        if first_active_sensor < active_sliders[0][0]:
-            return active_regions[0]
-
-        for i in range(len(active_sliders) - 1, -1, -1):
-            if first_active_sensor >= active_sliders[i][0]:
-                return active_regions[i]
-
-        return active_regions[0]
-        
-    except (ValueError, TypeError, IndexError):
-        return "Ascending"
-
-def determine_ending_region(row, sliders):
-    """Determine which colon region a pattern ends in based on last active sensor"""
-    try:
-        slider_values = getSliderValues(sliders)
-        if not slider_values:
-            return "Rectum"
-        
-        regions = ["Ascending", "Transverse", "Descending", "Sigmoid", "Rectum"]
-        
-        active_regions = []
-        active_sliders = []
-        for i, region in enumerate(regions):
-            if region not in disabled_sections and i < len(slider_values):
-                active_regions.append(region)
-                active_sliders.append(slider_values[i])
-        
-        if not active_regions:
-            return "Rectum"
-        
-        last_active_sensor = None
-        for row_idx in range(len(row) - 1, 12, -1):
-            if (row_idx < len(row) and row[row_idx] and row[row_idx].value is not None and 
-                isinstance(row[row_idx].value, (int, float)) and row[row_idx].value > 0):
-                last_active_sensor = row_idx - 12
-                break
-        
-        if last_active_sensor is None:
-            return active_regions[-1]
-        
-        for i, (start_sensor, end_sensor) in enumerate(active_sliders):
-            if start_sensor <= last_active_sensor <= end_sensor:
-                return active_regions[i]
-
-        if last_active_sensor > active_sliders[-1][1]:
-            return active_regions[-1]
-
-        for i in range(len(active_sliders)):
-            if last_active_sensor <= active_sliders[i][1]:
-                return active_regions[i]
-
-        return active_regions[-1]
-        
-    except (ValueError, TypeError, IndexError):
-        return "Rectum"
-
 def custom_sort(item):
     order = ["Ascending", "Transverse", "Descending", "Sigmoid", "Rectum"]
     return order.index(item)
@@ -264,64 +88,250 @@ def reset_disabled_sections():
     global disabled_sections
     disabled_sections = []
 
-def exportToXlsx(data, file_name, sliders, events, settings_sliders, pattern_params=None, first_event_field=None, original_first_row=None):
-    try:
-        base_name, ext = file_name.rsplit('.', 1)
-        new_file_name = f"{base_name}_analysis.xlsx"
+class SettingSnapshot:
+    """Fixed value standing in for a settings widget, so the export can run off the Tk thread or without a GUI"""
 
-        data.to_excel(new_file_name, index=False)
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
 
-        # Restore original first row if provided
-        if original_first_row:
-            wb = load_workbook(new_file_name)
-            ws = wb.active
-            
-            for col in range(1, ws.max_column + 1):
-                ws.cell(row=1, column=col).value = None
-            
-            for i, value in enumerate(original_first_row):
-                if value is not None:
-                    target_col = i + 1
-                    if target_col >= 12:
-                        target_col += 2
-                    ws.cell(row=1, column=target_col).value = value
-            
-            wb.save(new_file_name)
-
-        insertEmptyRows(new_file_name, 12)
-        create_space_for_comprehensive_table(new_file_name)
-        mergeAndColorCells(new_file_name, sliders)
-
-        # Add first event at 0-0-0
-        from exportToExcelScreen.events import get_first_event_name
-        first_event_name = get_first_event_name()
-        addEventNameAtGivenTime(new_file_name, 0, 0, 0, first_event_name)
-
-        event_names = [first_event_name]
-        for time, event_name in events.items():
-            event_names.append(event_name)
-            try:
-                total_seconds = time // 10
-                hour, remainder = divmod(total_seconds, 3600)
-                minute, second = divmod(remainder, 60)
-                addEventNameAtGivenTime(new_file_name, hour, minute, second, event_name)
-            except Exception as e:
-                print(f"Error processing event {event_name}: {e}")
-                raise
-        
-        wb = assignSectionsBasedOnStartSection(new_file_name, sliders, event_names, settings_sliders, pattern_params)
-        
-        file_name = filedialog.asksaveasfilename(
-            defaultextension=".xlsx", 
-            filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")], 
-            initialfile=new_file_name
-        )
-        
-        wb.save(file_name)
-        print(f"Data successfully exported to {new_file_name}")
-        
+    def get(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+def snapshot_widget(widget):
+    try:
+        return SettingSnapshot(widget.get())
     except Exception as e:
-        print(f"Error exporting data to Excel: {e}")
+        return SettingSnapshot(error=e)
+
+def snapshot_settings(widgets):
+    if widgets is None:
+        return None
+    if isinstance(widgets, dict):
+        return {key: snapshot_widget(widget) for key, widget in widgets.items()}
+    return [snapshot_widget(widget) for widget in widgets]
+
+def exportToXlsx(data, file_name, sliders, events, settings_sliders, pattern_params, first_event_field, button_export,
+                 button_cancel, progress_bar, progress_label, original_first_row=None):
+    base_name, ext = file_name.rsplit('.', 1)
+    new_file_name = f"{base_name}_analysis.xlsx"
+
+    # Ask where to save before doing any work
+    output_file = filedialog.asksaveasfilename(
+        defaultextension=".xlsx", 
+        filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")], 
+        initialfile=new_file_name
+    )
+    if not output_file:
+        return None
+
+    # Add first event at 0-0-0
+    from exportToExcelScreen.events import get_first_event_name
+    first_event_name = get_first_event_name()
+
+    # Widgets may only be read on the Tk thread
+    sliders = snapshot_settings(sliders)
+    settings_sliders = snapshot_settings(settings_sliders)
+    pattern_params = snapshot_settings(pattern_params)
+    events = dict(events)
+
+    button_export.configure(state='disabled')
+    button_cancel.configure(state='normal')
+    progress_bar.set(0)
+
+    def work(report, cancel_event):
+        wb = build_analysis_workbook(data, sliders, events, first_event_name, settings_sliders, pattern_params,
+                                     original_first_row, report, cancel_event)
+        report("Saving workbook", 0.95)
+        wb.save(output_file)
+        report("Export completed", 1.0)
+        return output_file
+
+    def finish(message):
+        if not progress_label.winfo_exists():
+            return
+        progress_label.configure(text=message)
+        button_export.configure(state='normal')
+        button_cancel.configure(state='disabled')
+
+    def on_progress(message, fraction):
+        if progress_label.winfo_exists():
+            progress_label.configure(text=message)
+            progress_bar.set(fraction)
+
+    def on_done(saved_file):
+        print(f"Data successfully exported to {saved_file}")
+        finish(f"Exported to {saved_file}")
+        if progress_label.winfo_exists():
+            show_info_popup("Succes", "Export Completed", progress_label)
+
+    def on_error(error):
+        if isinstance(error, TaskCancelled):
+            finish("Export cancelled")
+            return
+        print(f"Error exporting data to Excel: {error}")
+        finish("Export failed")
+
+    return run_in_background(progress_label, work, on_progress, on_done, on_error)
+
+def build_analysis_workbook(data, sliders, events, first_event_name, settings_sliders, pattern_params=None,
+                            original_first_row=None, report=None, cancel_event=None, write_only=None, workers=None):
+    """Build the analysis workbook with its final layout.
+
+    In write-only mode, the default for tables of WRITE_ONLY_MIN_ROWS rows or more, only the
+    rows down to the sequence header are kept in memory and the sequence rows are streamed
+    straight to a temporary file. Such a workbook can be saved once. Large tables are
+    classified on `workers` processes, one per CPU by default.
+    """
+    report = report or (lambda message, fraction=None: None)
+    if write_only is None:
+        write_only = len(data) >= WRITE_ONLY_MIN_ROWS
+    last_sheet_row = SEQUENCE_HEADER_ROW if write_only else None
+
+    event_names = [first_event_name]
+    timed_events = [(0, 0, 0, first_event_name)]
+    for time, event_name in events.items():
+        event_names.append(event_name)
+        total_seconds = time // 10
+        hour, remainder = divmod(total_seconds, 3600)
+        minute, second = divmod(remainder, 60)
+        timed_events.append((hour, minute, second, event_name))
+
+    report("Inserting rows", 0.0)
+    data_rows, event_rows = compute_sequence_layout(data, timed_events)
+    check_cancelled(cancel_event)
+
+    report(f"Writing {len(data)} rows", 0.05)
+    writer = pd.ExcelWriter(io.BytesIO(), engine="openpyxl")
+    if write_only:
+        kept_rows = bisect_right(data_rows, last_sheet_row)
+        write_sequence_table(writer, data.iloc[:kept_rows], data_rows[:kept_rows])
+    else:
+        write_sequence_table(writer, data, data_rows)
+    wb = writer.book
+    ws = wb.active
+    check_cancelled(cancel_event)
+
+    # Restore original first row if provided
+    if original_first_row:
+        for cell in ws[1]:
+            cell.value = None
+
+        for i, value in enumerate(original_first_row):
+            if value is not None:
+                target_col = i + 1
+                if target_col >= 12:
+                    target_col += 2
+                ws.cell(row=1, column=shifted_column(target_col)).value = value
+
+    report("Merging regions", 0.3)
+    region_map = RegionMap(getSliderValues(sliders), disabled_sections)
+    mergeAndColorCells(ws, region_map)
+
+    report(f"Inserting {len(event_rows)} events", 0.32)
+    for row, (hour, minute, second, event_name) in event_rows:
+        if last_sheet_row is None or row <= last_sheet_row:
+            write_event_row(ws, row, hour, minute, second, event_name)
+    check_cancelled(cancel_event)
+
+    params = get_pattern_parameters(pattern_params) if pattern_params else DEFAULT_PATTERN_PARAMETERS
+    report("Classifying sequences", 0.34)
+    classified, markers, interval_counts, statistics = analyse_sequence_table(data, data_rows, event_rows, region_map,
+                                                                              params, ws.max_column, workers, report,
+                                                                              cancel_event)
+    assignSectionsBasedOnStartSection(wb, classified, markers, interval_counts, statistics, region_map, event_names,
+                                      report, cancel_event, last_sheet_row)
+    if write_only:
+        timeline = sequence_timeline(classified, event_rows)
+        return stream_analysis_workbook(ws, data, classified, timeline, report, cancel_event)
+    return wb
+
+def shifted_column(col):
+    """Map a column of the plotHRM sheet to its column in the analysis sheet"""
+    return col if col < END_REGION_COLUMN else col + INSERTED_COLUMNS
+
+def event_time_key(hour, minute, second):
+    """Return a comparable (hour, minute, second) key, or None if the row has no valid time"""
+    if hour is None or minute is None or second is None:
+        return None
+    try:
+        return (int(hour), int(minute), int(second))
+    except (ValueError, TypeError):
+        return None
+
+def compute_sequence_layout(data, timed_events):
+    """Work out the final sheet row of every DataFrame row and every event marker.
+
+    Rows above the sequence table keep their position, everything from sheet row 13
+    downwards moves down to make room for the summary and comprehensive tables.
+    Each event is placed before the first row at or after its time, in the order the
+    events are given, so later events land before earlier ones with the same time.
+    """
+    first_moved = FIRST_MOVED_ROW - 2
+    first_timeline_row = FIRST_MOVED_ROW + MOVED_ROWS
+    data_rows = [index + 2 for index in range(min(first_moved, len(data)))]
+
+    times = [event_time_key(hour, minute, second)
+             for hour, minute, second in data.iloc[first_moved:, 1:4].itertuples(index=False, name=None)]
+    # The region band and sensor header always occupy the first two moved rows
+    timeline_length = max(len(times), SEQUENCE_HEADER_ROW - first_timeline_row + 1)
+    timed = [i for i, key in enumerate(times) if key is not None]
+    event_keys = [event_time_key(*event[:3]) for event in timed_events]
+
+    # Rank all times so they compare as integers; rows without a time never come after an event
+    keys = np.array([times[i] for i in timed] + event_keys, dtype=np.int64).reshape(-1, 3)
+    ranks = np.unique(keys, axis=0, return_inverse=True)[1].reshape(-1)
+    row_ranks = np.full(timeline_length, -1, dtype=np.int64)
+    row_ranks[timed] = ranks[:len(timed)]
+    event_ranks = ranks[len(timed):]
+
+    # An event goes before the first row whose time is at least its own, found by a binary search on the
+    # running maximum; events ending up between the same two rows are in time order, later events first
+    reached = np.maximum.accumulate(row_ranks)
+    order = np.lexsort((-np.arange(len(timed_events)), event_ranks))
+    gaps = np.searchsorted(reached, event_ranks[order], side='left')
+
+    event_rows = [(first_timeline_row + gap + position, timed_events[event])
+                  for position, (gap, event) in enumerate(zip(gaps.tolist(), order.tolist()))]
+    positions = np.arange(len(times))
+    data_rows += (first_timeline_row + positions + np.searchsorted(gaps, positions, side='right')).tolist()
+    return data_rows, event_rows
+
+def write_sequence_table(writer, data, data_rows):
+    """Write the DataFrame once, placing each run of consecutive rows at its final position"""
+    split = END_REGION_COLUMN - 1
+
+    segments = []
+    start = 0
+    for stop in range(1, len(data_rows) + 1):
+        if stop == len(data_rows) or data_rows[stop] != data_rows[stop - 1] + 1:
+            segments.append((start, stop))
+            start = stop
+
+    if not segments:
+        segments.append((0, 0))
+
+    for start, stop in segments:
+        header = start == 0
+        startrow = data_rows[start] - 1 if start < len(data_rows) else 1
+        if header:
+            startrow -= 1
+        segment = data.iloc[start:stop]
+        segment.iloc[:, :split].to_excel(writer, sheet_name=SHEET_NAME, startrow=startrow,
+                                         header=header, index=False)
+        if segment.shape[1] > split:
+            segment.iloc[:, split:].to_excel(writer, sheet_name=SHEET_NAME, startrow=startrow,
+                                             startcol=split + INSERTED_COLUMNS, header=header, index=False)
+
+        # pandas writes missing values as empty strings; store them as truly empty cells
+        written = writer.sheets[SHEET_NAME].iter_rows(min_row=startrow + 1, max_row=startrow + header + stop - start,
+                                                      max_col=segment.shape[1] + INSERTED_COLUMNS)
+        for row in written:
+            for cell in row:
+                if cell.value == "":
+                    cell.value = None
 
 def getSliderValues(sliders):
     list_with_slider_tuples = []
@@ -345,176 +355,47 @@ def getSliderValues(sliders):
         list_with_slider_tuples.append(slider_tuple)
     return list_with_slider_tuples
 
-def mergeAndColorCells(file_name, sliders):
-    wb = load_workbook(file_name)
-    ws = wb.active
-    
-    sections = ["Ascending", "Transverse", "Descending", "Sigmoid", "Rectum"]
-    sliders = getSliderValues(sliders)
-
-    for section in disabled_sections:
-        sections.remove(section)
-        sliders.pop(0)
-
-    colors = {
-        "Ascending": "A9D08E",
-        "Transverse": "BDD7EE",
-        "Descending": "F8CBAD",
-        "Sigmoid": "D9D9D9",
-        "Rectum": "B1A0C7"
-    }
-
-    # Insert columns for End Region and spacing
-    ws.insert_cols(12)
-    ws.insert_cols(13)
-
+def mergeAndColorCells(ws, region_map):
     ws.cell(row=72, column=12, value="End Region")
 
     # Color sequence table headers
-    header_color = "BFBFBF" 
     for col in range(1, 13):
         header_cell = ws.cell(row=72, column=col)
         if header_cell.value:
-            header_cell.fill = PatternFill(start_color=header_color, end_color=header_color, fill_type="solid")
-            header_cell.alignment = Alignment(horizontal='center', vertical='center')
+            style_cell(header_cell, HEADER_COLOR, centered=True)
 
     # Region headers and sensor numbers
-    for i, (start, end) in enumerate(sliders):
+    for section, start, end in region_map.bounds():
         start_col = get_column_letter(start + 13)
         end_col = get_column_letter(end + 13)
         
         # Region headers on row 71
         ws.merge_cells(f'{start_col}71:{end_col}71')
         cell = ws[f'{start_col}71']
-        cell.value = sections[i]
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        fill = PatternFill(start_color=colors[sections[i]], end_color=colors[sections[i]], fill_type="solid")
-        cell.fill = fill
+        cell.value = section
+        style_cell(cell, REGION_COLORS[section], centered=True)
 
         for col in range(start + 13, end + 14):
-            ws[f'{get_column_letter(col)}71'].fill = fill
+            style_cell(ws[f'{get_column_letter(col)}71'], REGION_COLORS[section])
 
         # Sensor numbers on row 72
         for sensor_num in range(start, end + 1):
             sensor_col = sensor_num + 13
             sensor_cell = ws.cell(row=72, column=sensor_col, value=sensor_num)
-            sensor_cell.alignment = Alignment(horizontal='center', vertical='center')
-            sensor_cell.fill = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")
-
-    wb.save(file_name)
+            style_cell(sensor_cell, SENSOR_HEADER_COLOR, centered=True)
 
-def addEventNameAtGivenTime(file_name, hour, minute, second, event_name):
-    wb = load_workbook(file_name)
-    ws = wb.active
-    
-    insertion_row = None
-    for row in range(27, ws.max_row + 1):
-        try:
-            cell_hour = ws.cell(row=row, column=2).value
-            cell_minute = ws.cell(row=row, column=3).value
-            cell_second = ws.cell(row=row, column=4).value
-            
-            if cell_hour is None or cell_minute is None or cell_second is None:
-                continue
-            
-            try:
-                cell_hour_int = int(cell_hour)
-                cell_minute_int = int(cell_minute)
-                cell_second_int = int(cell_second)
-                hour_int = int(hour)
-                minute_int = int(minute)
-                second_int = int(second)
-            except (ValueError, TypeError):
-                continue
-            
-            if (cell_hour_int > hour_int or 
-                (cell_hour_int == hour_int and cell_minute_int > minute_int) or 
-                (cell_hour_int == hour_int and cell_minute_int == minute_int and cell_second_int >= second_int)):
-                insertion_row = row
-                break
-                
-        except Exception:
-            continue
-    
-    if insertion_row is None:
-        insertion_row = ws.max_row + 1
-    
-    ws.insert_rows(insertion_row)
-    
+def write_event_row(ws, row, hour, minute, second, event_name):
     for col in range(1, 13):
-        cell = ws.cell(row=insertion_row, column=col)
+        cell = ws.cell(row=row, column=col)
         cell.value = event_name
-        cell.fill = PatternFill(start_color=EVENT_COLOR, end_color=EVENT_COLOR, fill_type="solid")
-    
-    ws.cell(row=insertion_row, column=2, value=hour)
-    ws.cell(row=insertion_row, column=3, value=minute)
-    ws.cell(row=insertion_row, column=4, value=second)
-
-    wb.save(file_name)
-
-def insertEmptyRows(file_name, amount):
-    wb = load_workbook(file_name)
-    ws = wb.active
-
-    for i in range(amount):
-        ws.insert_rows(13 + i)
-    
-    wb.save(file_name)
-
-def assignSectionsBasedOnStartSection(file_name, sliders, event_names, settings_sliders, pattern_params=None):
-    params = get_pattern_parameters(pattern_params) if pattern_params else {
-        'LONG_PATTERN_MINIMUM_SENSORS': 5,
-        'HAPC_PATTERN_MINIMUM_SENSORS': 5,
-        'HIGH_AMPLITUDE_MINIMUM_PATTERN_LENGTH': 3,
-        'HIGH_AMPLITUDE_MINIMUM_VALUE': 100
-    }
-
-    try:
-        if settings_sliders and len(settings_sliders) > 0:
-            slider_value = settings_sliders[0].get()
-            distance_between_sensors = int(round(slider_value)) if slider_value is not None else 25
-        else:
-            distance_between_sensors = 25
-    except Exception:
-        distance_between_sensors = 25
+        style_cell(cell, EVENT_COLOR)
     
-    wb = load_workbook(file_name)
-    ws = wb.active
-
-    all_events = event_names.copy()
-
-    comprehensive_stats = initialize_comprehensive_statistics(all_events)
-    
-    sections = ["Ascending", "Transverse", "Descending", "Sigmoid", "Rectum"]
-    colors = {
-        "Ascending": "A9D08E",
-        "Transverse": "BDD7EE", 
-        "Descending": "F8CBAD",
-        "Sigmoid": "D9D9D9",
-        "Rectum": "B1A0C7",
-        "Ascending tot in Rectum": "81BA5A",
-        "Transverse tot in Rectum": "81B2DF",
-        "Descending tot in Rectum": "F2A16A",
-        "Sigmoid tot in Rectum": "BEBEBE"
-    }
-
-    slider_values = getSliderValues(sliders)
-    
-    counters = {}
-    length_counters = {}
-    high_amplitude_counters = {}
-    
-    # Initialize with first event from event_names if any exist
-    if event_names:
-        current_event = event_names[0]
-    else:
-        current_event = "Default"  # Fallback if no events defined
-    
-    for event_name in event_names:
-        counters[event_name] = {}
-        length_counters[event_name] = {}  
-        high_amplitude_counters[event_name] = {}
+    ws.cell(row=row, column=2, value=hour)
+    ws.cell(row=row, column=3, value=minute)
+    ws.cell(row=row, column=4, value=second)
 
+def summary_templates():
+    """Empty region, length and high amplitude counters of one event, without the disabled regions"""
     counter_template = {
         "Ascending": 0, "Transverse": 0, "Descending": 0, "Sigmoid": 0, "Rectum": 0,
         "Ascending tot in Rectum": 0, "Transverse tot in Rectum": 0,
@@ -531,9 +412,6 @@ def assignSectionsBasedOnStartSection(file_name, sliders, event_names, settings_
     # Remove disabled sections
     keys_to_remove = []
     for section in disabled_sections:
-        if section in sections:
-            sections.remove(section)
-            slider_values.pop(0)
         for key in counter_template.keys():
             if section in key:
                 keys_to_remove.append(key)
@@ -542,148 +420,215 @@ def assignSectionsBasedOnStartSection(file_name, sliders, event_names, settings_
         if key in counter_template:
             del counter_template[key]
 
+    return counter_template, length_counter_template, high_amplitude_counters_template
+
+def count_intervals(classified, intervals, interval_total, templates):
+    """Count the sequences of every interval into the summary counters, one row per interval.
+
+    Columns follow the keys of the counter, length counter and high amplitude counter templates.
+    """
+    counter_template, length_counter_template, high_amplitude_counters_template = templates
+    keys = {key: column for column, key in enumerate(chain(counter_template, length_counter_template,
+                                                           high_amplitude_counters_template))}
+    sequence = classified['kind'] == SEQUENCE
+    counted = sequence & classified['counted']
+    starting_regions = classified['starting_region'].tolist()
+
+    # HAPCs and HARPCs count as one unit, even when their length is unreadable
+    hapc = sequence & classified['is_hapc']
+    harpc = sequence & classified['is_harpc'] & ~classified['is_hapc']
+    entries = [(intervals[hapc], keys["HAPCs"]), (intervals[harpc], keys["HARPCs"])]
+
+    lengths = np.where(classified['is_long'], "Long", "Short")
+    length_keys = np.array([keys.get(f"{length} {direction}", -1) if direction else -1
+                            for length, direction in zip(lengths.tolist(), classified['direction'].tolist())],
+                           dtype=np.int64)
+    region_keys = np.array([keys.get(region, -1) for region in starting_regions], dtype=np.int64)
+    pan_colonic_keys = np.array([keys.get(f'{region} tot in Rectum', -1) for region in starting_regions],
+                                dtype=np.int64)
+    pan_colonic = counted & classified['pan_colonic'] & (region_keys >= 0) & (pan_colonic_keys >= 0)
+
+    for column, mask in [(length_keys, counted & (length_keys >= 0)), (region_keys, counted & (region_keys >= 0)),
+                         (pan_colonic_keys, pan_colonic)]:
+        entries.append((intervals[mask], column[mask]))
+
+    counts = np.zeros(interval_total * len(keys), dtype=np.int64)
+    for interval, column in entries:
+        counts += np.bincount(interval * len(keys) + column, minlength=len(counts))
+    return counts.reshape(interval_total, len(keys))
+
+def analyse_partition(data, rows, event_rows, region_map, params, sensor_count, templates):
+    """Classify consecutive rows of the sequence table and aggregate their sequences per event interval.
+
+    rows are the sheet rows of the table rows and event_rows the events placed among them. Returns
+    the classification, with the sheet row and event interval of every row, the (sheet row, event)
+    of every event marker in sheet order, and the summary counts and comprehensive statistics
+    of the len(markers) + 1 intervals between them.
+    """
+    classified = classify_sequences(data, region_map, params, sensor_count)
+    classified['row'] = np.asarray(rows, dtype=np.int64)
+
+    markers = [(row, marker) for row, marker, kind in zip(rows, classified['marker'], classified['kind'].tolist())
+               if kind == EVENT_MARKER]
+    markers += [(row, event[3].strip()) for row, event in event_rows if is_event_marker(event[3])]
+    markers.sort(key=lambda marker: marker[0])
+
+    marker_rows = np.array([row for row, marker in markers], dtype=np.int64)
+    classified['interval'] = np.searchsorted(marker_rows, classified['row'], side='right')
+    interval_total = len(markers) + 1
+    counts = count_intervals(classified, classified['interval'], interval_total, templates)
+    statistics = interval_statistics(classified, np.flatnonzero(classified['kind'] == SEQUENCE), interval_total)
+
+    # Only the statistics of the amplitudes go back to the parent, and the broken sensors packed eight to a byte
+    del classified['amplitudes']
+    classified['broken'] = np.packbits(classified['broken'], axis=1)
+    return classified, markers, counts, statistics
+
+def join_partitions(parts):
+    """Join the analyses of consecutive partitions of the sequence table.
+
+    The last interval of a partition and the first of the next are the same interval, so their
+    counts and statistics merge; the intervals of each partition are numbered after those of
+    the previous one.
+    """
+    classified = {}
+    for key in parts[0][0]:
+        if key == 'marker':
+            classified[key] = [marker for part in parts for marker in part[0][key]]
+        else:
+            classified[key] = np.concatenate([part[0][key] for part in parts])
+
+    markers = []
+    intervals = []
+    interval_counts = parts[0][2]
+    statistics = SequenceStatistics((sum(len(part[1]) for part in parts) + 1) * BUCKETS_PER_EVENT)
+    for part_classified, part_markers, part_counts, part_statistics in parts:
+        intervals.append(part_classified['interval'] + len(markers))
+        statistics.merge(part_statistics, len(markers) * BUCKETS_PER_EVENT)
+        markers += part_markers
+    for part_classified, part_markers, part_counts, part_statistics in parts[1:]:
+        interval_counts = np.vstack([interval_counts[:-1], interval_counts[-1:] + part_counts[:1], part_counts[1:]])
+    classified['interval'] = np.concatenate(intervals)
+    return classified, markers, interval_counts, statistics
+
+def analyse_sequence_table(data, data_rows, event_rows, region_map, params, max_column, workers=None, report=None,
+                           cancel_event=None):
+    """Classify the sequence table and split it into event intervals, see analyse_partition.
+
+    Tables of PARALLEL_MIN_ROWS rows or more are split into one partition per worker, which are
+    classified and counted on a process pool and joined in sheet order.
+    """
+    # Sensor n is in sheet column n + 13
+    first_row = bisect_left(data_rows, FIRST_CLASSIFIED_ROW)
+    sensor_count = min(max_column, LAST_CLASSIFIED_COLUMN) - 13
+    templates = summary_templates()
+    rows = data_rows[first_row:]
+
+    workers = workers or os.cpu_count() or 1
+    if workers < 2 or len(rows) < max(PARALLEL_MIN_ROWS, 2):
+        partitions = [(0, len(rows))]
+    else:
+        bounds = np.linspace(0, len(rows), workers + 1).astype(np.int64).tolist()
+        partitions = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+    # Events go to the partition of the first table row after them, events after the table to the last one
+    event_partitions = [[] for partition in partitions]
+    starts = [rows[start] for start, stop in partitions[1:]]
+    for row, event in event_rows:
+        event_partitions[bisect_left(starts, row)].append((row, event))
+
+    arguments = [(data.iloc[first_row + start:first_row + stop], rows[start:stop], events, region_map, params,
+                  sensor_count, templates) for (start, stop), events in zip(partitions, event_partitions)]
+    if len(partitions) == 1:
+        parts = [analyse_partition(*arguments[0])]
+    else:
+        parts = []
+        pool = ProcessPoolExecutor(max_workers=len(partitions))
+        try:
+            futures = [pool.submit(analyse_partition, *partition_arguments) for partition_arguments in arguments]
+            # Partitions are in sheet order, so joining them keeps the order of the events
+            for done, future in enumerate(futures, start=1):
+                parts.append(future.result())
+                check_cancelled(cancel_event)
+                if report:
+                    report(f"Classified {done}/{len(futures)} partitions", 0.34 + 0.01 * done / len(futures))
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    classified, markers, interval_counts, statistics = join_partitions(parts)
+    classified['first_row'] = first_row
+    return classified, markers, interval_counts, statistics
+
+def sequence_timeline(classified, event_rows):
+    """Classified rows and events in sheet order: (sheet row, classification index, None) for table rows
+    and (sheet row, None, event) for events"""
+    timeline = [(row, index, None) for index, row in enumerate(classified['row'].tolist())]
+    timeline += [(row, None, event) for row, event in event_rows]
+    timeline.sort(key=lambda entry: entry[0])
+    return timeline
+
+def fold_event_intervals(markers, interval_counts, event_names, region_names, templates):
+    """Walk the event intervals in sheet order and collect the summary counters of every event.
+
+    Every event marker stores the counters of the running event; a marker naming a known event
+    also starts counting that event from zero. Returns the region, length and high amplitude
+    counters per event and the event every interval was counted for.
+    """
+    counter_template, length_counter_template, high_amplitude_counters_template = templates
+    all_events = event_names.copy()
+    counters = {}
+    length_counters = {}
+    high_amplitude_counters = {}
+
+    for event_name in event_names:
+        counters[event_name] = {}
+        length_counters[event_name] = {}  
+        high_amplitude_counters[event_name] = {}
+
     counter = counter_template.copy()
     length_counter = length_counter_template.copy()
     high_amplitude_counter = high_amplitude_counters_template.copy()
     
+    # Initialize with first event from event_names if any exist
     if event_names:
         current_event = event_names[0]
     else:
-        current_event = "Default"
+        current_event = "Default"  # Fallback if no events defined
 
-    # Process each pattern row
-    for row_idx in range(27, ws.max_row + 1):
-        try:
-            row = [ws.cell(row=row_idx, column=col) for col in range(1, min(ws.max_column + 1, 50))]
-            
-            if len(row) < 12 or not row[0].value:
-                continue
+    interval_events = []
+    for interval, counts in enumerate(interval_counts.tolist()):
+        interval_events.append(current_event)
+        for accumulator in [counter, length_counter, high_amplitude_counter]:
+            for key in accumulator:
+                accumulator[key] += counts.pop(0)
 
-            # Check for event markers
-            if (isinstance(row[0].value, str) and 
-                not str(row[0].value).isdigit() and 
-                row[0].value not in ['Sequence', 'Hour', 'Minute', 'Second', 'Sample']):
-                
-                for event in all_events:
-                    if event not in counters or not counters[event]:
-                        counters[event] = counter_template.copy()
-                        length_counters[event] = length_counter_template.copy() 
-                        high_amplitude_counters[event] = high_amplitude_counters_template.copy()
-
-                # Apply anti-double-counting
-                length_counter["Long a"] = max(0, length_counter["Long a"] - high_amplitude_counter["HAPCs"])
-                length_counter["Long r"] = max(0, length_counter["Long r"] - high_amplitude_counter["HARPCs"])
-
-                counters[current_event] = dict(counter)
-                length_counters[current_event] = dict(length_counter)  
-                high_amplitude_counters[current_event] = dict(high_amplitude_counter)
-                
-                new_event = row[0].value.strip()
-                
-                if new_event in all_events:
-                    current_event = new_event
-                    counter = counter_template.copy()
-                    length_counter = length_counter_template.copy()
-                    high_amplitude_counter = high_amplitude_counters_template.copy()
-                
-                continue
+        if interval == len(markers):
+            break
+        new_event = markers[interval][1]
 
-            # Skip header rows
-            if (isinstance(row[0].value, str) and 
-                row[0].value in ['Sequence', 'Hour', 'Minute', 'Second', 'Sample']):
-                continue
+        for event in all_events:
+            if event not in counters or not counters[event]:
+                counters[event] = counter_template.copy()
+                length_counters[event] = length_counter_template.copy()
+                high_amplitude_counters[event] = high_amplitude_counters_template.copy()
 
-            if (len(row) > 10 and row[10].value and 
-                isinstance(row[10].value, str) and 
-                not str(row[10].value).replace('.', '').replace('-', '').isdigit()):
-                continue
-                
-            classification = classify_pattern_enhanced(row, sliders, distance_between_sensors, params)
-            starting_region = determine_starting_region(row, sliders)
-            ending_region = determine_ending_region(row, sliders)
-            classification['starting_region'] = starting_region
-
-            # Fill region columns
-            region_cell = ws.cell(row=row_idx, column=11, value=starting_region)
-            end_region_cell = ws.cell(row=row_idx, column=12, value=ending_region)
-            
-            region_colors = {
-                "Ascending": "A9D08E",
-                "Transverse": "BDD7EE", 
-                "Descending": "F8CBAD",
-                "Sigmoid": "D9D9D9",
-                "Rectum": "B1A0C7"
-            }
-
-            if starting_region in region_colors:
-                region_cell.fill = PatternFill(start_color=region_colors[starting_region], 
-                                            end_color=region_colors[starting_region], fill_type="solid")
-                
-            if ending_region in region_colors:
-                end_region_cell.fill = PatternFill(start_color=region_colors[ending_region], 
-                                            end_color=region_colors[ending_region], fill_type="solid")
-            
-            update_comprehensive_stats(comprehensive_stats, classification, current_event, row, sliders)
-            
-            # Get sequence range for this row
-            first_sensor, last_sensor = get_sequence_range(row)
-
-            # Fill broken sensors within the sequence
-            fill_broken_sensors_in_sequence(ws, row_idx, row, first_sensor, last_sensor)
-
-            # Handle HAPCs/HARPCs - treat entire sequence as one unit
-            if classification['is_hapc']:
-                high_amplitude_counter["HAPCs"] += 1
-                comprehensive_stats[current_event]['HAPCs']['count'] += 1
-                if classification['velocity'] != 0:
-                    comprehensive_stats[current_event]['HAPCs']['velocities'].append(classification['velocity'])
-                if classification['amplitudes']:
-                    comprehensive_stats[current_event]['HAPCs']['amplitudes'].extend(classification['amplitudes'])
-                
-                # Color entire sequence green (including broken sensors)
-                color_entire_sequence(ws, row_idx, row, first_sensor, last_sensor, "92D050")
-                            
-            elif classification['is_harpc']:
-                high_amplitude_counter["HARPCs"] += 1
-                comprehensive_stats[current_event]['HARPCs']['count'] += 1
-                if classification['velocity'] != 0:
-                    comprehensive_stats[current_event]['HARPCs']['velocities'].append(classification['velocity'])
-                if classification['amplitudes']:
-                    comprehensive_stats[current_event]['HARPCs']['amplitudes'].extend(classification['amplitudes'])
-                
-                # Color entire sequence red (including broken sensors)
-                color_entire_sequence(ws, row_idx, row, first_sensor, last_sensor, "FF0000")
-
-            # Update pattern counters
-            pattern = classification['direction']
-            length_sensors = 0
-            if len(row) > 9 and row[9] and row[9].value is not None:
-                try:
-                    length_sensors = int(float(str(row[9].value)))
-                except (ValueError, TypeError):
-                    continue
-            
-            if pattern and classification['length_category']:
-                pattern_type = classification['length_category']
-                counter_key = f"{pattern_type} {pattern}"
-                
-                if counter_key in length_counter:
-                    length_counter[counter_key] += 1
+        # Apply anti-double-counting
+        length_counter["Long a"] = max(0, length_counter["Long a"] - high_amplitude_counter["HAPCs"])
+        length_counter["Long r"] = max(0, length_counter["Long r"] - high_amplitude_counter["HARPCs"])
 
-            # Regional counting
-            if starting_region and starting_region in counter:
-                counter[starting_region] += 1
-                
-                if is_pan_colonic_pattern(row, sliders, starting_region):
-                    pan_colonic_key = f'{starting_region} tot in Rectum'
-                    if pan_colonic_key in counter:
-                        counter[pan_colonic_key] += 1
-        except Exception:
-            continue
+        counters[current_event] = dict(counter)
+        length_counters[current_event] = dict(length_counter)
+        high_amplitude_counters[current_event] = dict(high_amplitude_counter)
+
+        if new_event in all_events:
+            current_event = new_event
+            counter = counter_template.copy()
+            length_counter = length_counter_template.copy()
+            high_amplitude_counter = high_amplitude_counters_template.copy()
 
     # Handle final event
     if counters[current_event] == {}:
-        for section in sections[:-1] if len(sections) > 1 else []:
+        for section in region_names[:-1]:
             section_key = f'{section} tot in Rectum'
             if section_key in counter:
                 counter[section] = max(0, counter[section] - counter[section_key])
@@ -703,49 +648,77 @@ def assignSectionsBasedOnStartSection(file_name, sliders, event_names, settings_
         length_counters[current_event] = length_counter.copy()
         high_amplitude_counters[current_event] = high_amplitude_counter.copy()
 
-    # Calculate correct totals before applying HAPC/HARPC corrections
-    calculate_correct_totals(comprehensive_stats)
-    apply_hapc_harpc_corrections_fixed(comprehensive_stats)
+    return counters, length_counters, high_amplitude_counters, interval_events
+
+def assignSectionsBasedOnStartSection(wb, classified, markers, interval_counts, statistics, region_map, event_names,
+                                      report=None, cancel_event=None, last_sheet_row=None):
+    """Fill in the regions, colors and summary tables from the classified sequences.
 
+    statistics are the comprehensive statistics of the event intervals, see interval_statistics.
+    Sequence rows below last_sheet_row are only counted, not written.
+    """
+    ws = wb.active
+
+    all_events = event_names.copy()
+
+    colors = dict(REGION_COLORS)
+    for region, color in PAN_COLONIC_COLORS.items():
+        colors[f"{region} tot in Rectum"] = color
+
+    templates = summary_templates()
+    counter_template, length_counter_template, high_amplitude_counters_template = templates
+    counters, length_counters, high_amplitude_counters, interval_events = fold_event_intervals(
+        markers, interval_counts, event_names, region_map.names, templates)
+
+    sequences = np.flatnonzero(classified['kind'] == SEQUENCE)
+
+    rows = classified['row'][sequences].tolist()
+    last_row = max(ws.max_row, rows[-1] if rows else 0)
+    next_progress_row = PROGRESS_ROW_INTERVAL
+    for row_idx, index in zip(rows, sequences.tolist()):
+        if last_sheet_row is not None and row_idx > last_sheet_row:
+            break
+        if row_idx >= next_progress_row:
+            next_progress_row = (row_idx // PROGRESS_ROW_INTERVAL + 1) * PROGRESS_ROW_INTERVAL
+            check_cancelled(cancel_event)
+            if report:
+                report(f"Writing row {row_idx} of {last_row}", 0.35 + 0.5 * row_idx / last_row)
+        write_sequence_row(ws, row_idx, classified, index)
+
+    comprehensive_stats = ComprehensiveStatistics(all_events, statistics, interval_events)
     sync_old_table_with_comprehensive_totals(length_counters, high_amplitude_counters, comprehensive_stats, all_events)
     
+    check_cancelled(cancel_event)
+    if report:
+        report("Creating comprehensive table", 0.85)
     create_comprehensive_analysis_table(wb, comprehensive_stats, all_events)
     
     # Create summary table
     row = 3
     for section in counter_template.keys():
-        ws.cell(row=row, column=19, value=section)
-        fill = PatternFill(start_color=colors[section], end_color=colors[section], fill_type="solid")
-        ws.cell(row=row, column=19).fill = fill
+        style_cell(ws.cell(row=row, column=19, value=section), colors[section])
         row += 1
     row += 1
     
     length_counter_row_start = row
     for pattern in list(chain(length_counter_template.keys(), high_amplitude_counters_template.keys())):
-        ws.cell(row=row, column=19, value=pattern)
-        
         if pattern == "HAPCs":
-            fill = PatternFill(start_color="92D050", end_color="92D050", fill_type="solid")
+            color = HAPC_COLOR
         elif pattern == "HARPCs":
-            fill = PatternFill(start_color="FF0000", end_color="FF0000", fill_type="solid")
+            color = HARPC_COLOR
         else:
-            fill = PatternFill(start_color="F4B084", end_color="F4B084", fill_type="solid")
-        
-        ws.cell(row=row, column=19).fill = fill
+            color = PATTERN_COLOR
+        style_cell(ws.cell(row=row, column=19, value=pattern), color)
         row += 1
     
     # Fill counters
     column = 20
     for (event,value) in counters.items():
         row = 2
-        ws.cell(row=row, column=column, value=event)
-        fill = PatternFill(start_color=EVENT_COLOR, end_color=EVENT_COLOR, fill_type="solid")
-        ws.cell(row=row, column=column).fill = fill
+        style_cell(ws.cell(row=row, column=column, value=event), EVENT_COLOR)
         row += 1
         for (section,value) in value.items():
-            ws.cell(row=row, column=column, value=value)
-            fill = PatternFill(start_color=colors[section], end_color=colors[section], fill_type="solid")
-            ws.cell(row=row, column=column).fill = fill
+            style_cell(ws.cell(row=row, column=column, value=value), colors[section])
             row += 1
         column += 1
     
@@ -768,58 +741,6 @@ def assignSectionsBasedOnStartSection(file_name, sliders, event_names, settings_
     
     return wb
 
-def calculate_correct_totals(comprehensive_stats):
-    """Calculate totals by summing individual region counts"""
-    regions = ["Ascending", "Transverse", "Descending", "Sigmoid", "Rectum"]
-    region_ranges = ["Ascending - Rectum", "Transverse - Rectum", "Descending - Rectum", "Sigmoid-Rectum"]
-    
-    for event in comprehensive_stats:
-        for pattern_type in comprehensive_stats[event]:
-            if pattern_type in ['HAPCs', 'HARPCs', 'cyclic s', 'cyclic r', 'cyclic a']:
-                continue  # Skip special categories
-                
-            # Sum all individual regions and pan-colonic patterns
-            total_count = 0
-            total_velocities = []
-            total_amplitudes = []
-            
-            for region in regions:
-                if region in comprehensive_stats[event][pattern_type]:
-                    stats = comprehensive_stats[event][pattern_type][region]
-                    total_count += stats['count']
-                    total_velocities.extend(stats['velocities'])
-                    total_amplitudes.extend(stats['amplitudes'])
-            
-            for region_range in region_ranges:
-                if region_range in comprehensive_stats[event][pattern_type]:
-                    stats = comprehensive_stats[event][pattern_type][region_range]
-                    total_count += stats['count']
-                    total_velocities.extend(stats['velocities'])
-                    total_amplitudes.extend(stats['amplitudes'])
-            
-            # Update the Total
-            comprehensive_stats[event][pattern_type]['Total'] = {
-                'count': total_count,
-                'velocities': total_velocities,
-                'amplitudes': total_amplitudes
-            }
-
-def apply_hapc_harpc_corrections_fixed(comprehensive_stats):
-    """Apply HAPC/HARPC corrections only to the patterns that were actually HAPCs/HARPCs"""
-    for event in comprehensive_stats:
-        hapc_count = comprehensive_stats[event]['HAPCs']['count']
-        harpc_count = comprehensive_stats[event]['HARPCs']['count']
-        
-        # Only subtract HAPCs from Long a total if there are actual HAPCs
-        if hapc_count > 0 and 'Long a' in comprehensive_stats[event]:
-            current_total = comprehensive_stats[event]['Long a']['Total']['count']
-            comprehensive_stats[event]['Long a']['Total']['count'] = max(0, current_total - hapc_count)
-        
-        # Only subtract HARPCs from Long r total if there are actual HARPCs  
-        if harpc_count > 0 and 'Long r' in comprehensive_stats[event]:
-            current_total = comprehensive_stats[event]['Long r']['Total']['count']
-            comprehensive_stats[event]['Long r']['Total']['count'] = max(0, current_total - harpc_count)
-
 def sync_old_table_with_comprehensive_totals(length_counters, high_amplitude_counters, comprehensive_stats, all_events):
     """Sync the old table totals with the corrected comprehensive table totals"""
     pattern_mapping = {
@@ -832,94 +753,10 @@ def sync_old_table_with_comprehensive_totals(length_counters, high_amplitude_cou
     }
     
     for event in all_events:
-        if event in comprehensive_stats and event in length_counters:
+        if event in comprehensive_stats.events and event in length_counters:
             for old_pattern, comp_pattern in pattern_mapping.items():
-                if comp_pattern in comprehensive_stats[event] and 'Total' in comprehensive_stats[event][comp_pattern]:
-                    # Use the corrected total from comprehensive table
-                    corrected_total = comprehensive_stats[event][comp_pattern]['Total']['count']
-                    length_counters[event][old_pattern] = corrected_total
-
-def update_comprehensive_stats(comprehensive_stats, classification, current_event, row, sliders):
-    """Update comprehensive statistics with pattern data"""
-    if current_event not in comprehensive_stats:
-        return
-    
-    pattern_key = f"{classification['length_category']} {classification['direction']}"
-    starting_region = classification['starting_region']
-    
-    if pattern_key not in comprehensive_stats[current_event]:
-        return
-    
-    # Update regional stats
-    if starting_region in comprehensive_stats[current_event][pattern_key]:
-        stats = comprehensive_stats[current_event][pattern_key][starting_region]
-        stats['count'] += 1
-        if classification['velocity'] != 0:
-            stats['velocities'].append(classification['velocity'])
-        if classification['amplitudes']:
-            stats['amplitudes'].extend(classification['amplitudes'])
-    
-    # Check for pan-colonic patterns
-    if is_pan_colonic_pattern(row, sliders, starting_region):
-        if starting_region == "Sigmoid":
-            region_range = "Sigmoid-Rectum"
-        else:
-            region_range = f"{starting_region} - Rectum"
-            
-        if region_range in comprehensive_stats[current_event][pattern_key]:
-            stats = comprehensive_stats[current_event][pattern_key][region_range]
-            stats['count'] += 1
-            if classification['velocity'] != 0:
-                stats['velocities'].append(classification['velocity'])
-            if classification['amplitudes']:
-                stats['amplitudes'].extend(classification['amplitudes'])
-
-def is_pan_colonic_pattern(row, sliders, starting_region):
-    """Check if pattern propagates to rectum"""
-    slider_values = getSliderValues(sliders)
-    if len(slider_values) < 5:
-        return False
-    
-    rectum_start, rectum_end = slider_values[4]
-    
-    # Check rectum activity
-    has_rectum_activity = False
-    for col in range(13, min(len(row), rectum_end + 13)):
-        sensor_num = col - 12
-        if (rectum_start <= sensor_num <= rectum_end and 
-            col < len(row) and row[col].value is not None and 
-            isinstance(row[col].value, (int, float)) and row[col].value > 0):
-            has_rectum_activity = True
-            break
-    
-    # Check starting region activity
-    starting_region_idx = None
-    regions = ["Ascending", "Transverse", "Descending", "Sigmoid", "Rectum"]
-    if starting_region in regions:
-        starting_region_idx = regions.index(starting_region)
-    
-    if starting_region_idx is not None and starting_region_idx < len(slider_values):
-        start_sensors, end_sensors = slider_values[starting_region_idx]
-        has_starting_activity = any(
-            (start_sensors <= (col - 12) <= end_sensors and
-             col < len(row) and row[col].value is not None and 
-             isinstance(row[col].value, (int, float)) and row[col].value > 0)
-            for col in range(13, min(len(row), end_sensors + 13))
-        )
-        
-        return has_rectum_activity and has_starting_activity
-    
-    return False
-
-def create_space_for_comprehensive_table(file_name):
-    """Move existing sequence/pan-colonic tables down to make space for comprehensive table"""
-    wb = load_workbook(file_name)
-    ws = wb.active
-    
-    rows_to_insert = 71 - 25
-    ws.insert_rows(25, rows_to_insert)
-    
-    wb.save(file_name)
+                # Use the corrected total from comprehensive table
+                length_counters[event][old_pattern] = comprehensive_stats.count(event, comp_pattern, 'Total')
 
 def create_comprehensive_analysis_table(wb, comprehensive_stats, event_names):
     """Create the comprehensive analysis table at AA2:BC68"""
@@ -941,19 +778,14 @@ def create_comprehensive_analysis_table(wb, comprehensive_stats, event_names):
     
     current_row = start_row + 2
     
-    pattern_types = ["Long s", "Short s", "Long r", "Short r", "Long a", "Short a"]
-    regions = ["Ascending", "Transverse", "Descending", "Sigmoid", "Rectum"]
-    region_ranges = ["Ascending - Rectum", "Transverse - Rectum", 
-                    "Descending - Rectum", "Sigmoid-Rectum"]
-    
-    for pattern_type in pattern_types:
-        for region in regions:
+    for pattern_type in PATTERN_TYPES[:6]:
+        for region in REGIONS:
             row_label = f"{pattern_type} {region}"
             create_pattern_row(ws, current_row, start_col, row_label, 
                              comprehensive_stats, event_names, pattern_type, region)
             current_row += 1
         
-        for region_range in region_ranges:
+        for region_range in REGION_RANGES:
             row_label = f"{pattern_type} {region_range}"
             create_pattern_row(ws, current_row, start_col, row_label, 
                              comprehensive_stats, event_names, pattern_type, region_range)
@@ -1012,65 +844,30 @@ def create_pattern_row(ws, row, start_col, row_label, comprehensive_stats,
         
         col_offset = 1
         for event in event_names:
-            stats = get_pattern_statistics(comprehensive_stats, event, pattern_type, region_key)
+            count, velocity, amplitude = comprehensive_stats.summary(event, pattern_type, region_key)
             
-            ws.cell(row=row, column=start_col + col_offset, value=stats['count'])
+            ws.cell(row=row, column=start_col + col_offset, value=count)
             
-            if stats['velocities']:
-                ws.cell(row=row, column=start_col + col_offset + 1, 
-                       value=round(min(stats['velocities']), 2))
-                ws.cell(row=row, column=start_col + col_offset + 2, 
-                       value=round(max(stats['velocities']), 2))
-                ws.cell(row=row, column=start_col + col_offset + 3, 
-                       value=round(sum(stats['velocities']) / len(stats['velocities']), 2))
+            if velocity:
+                for j, value in enumerate(velocity):
+                    ws.cell(row=row, column=start_col + col_offset + 1 + j, value=round(value, 2))
             
-            if stats['amplitudes']:
-                ws.cell(row=row, column=start_col + col_offset + 4, 
-                       value=round(min(stats['amplitudes']), 1))
-                ws.cell(row=row, column=start_col + col_offset + 5, 
-                       value=round(max(stats['amplitudes']), 1))
-                ws.cell(row=row, column=start_col + col_offset + 6, 
-                       value=round(sum(stats['amplitudes']) / len(stats['amplitudes']), 1))
+            if amplitude:
+                for j, value in enumerate(amplitude):
+                    ws.cell(row=row, column=start_col + col_offset + 4 + j, value=round(value, 1))
             
             col_offset += 7
             
     except Exception:
         pass
 
-def get_pattern_statistics(comprehensive_stats, event, pattern_type, region_key):
-    """Get statistics for a specific pattern type, event, and region"""
-    default_stats = {'count': 0, 'velocities': [], 'amplitudes': []}
-    
-    if event not in comprehensive_stats:
-        return default_stats
-    
-    if pattern_type in ['HAPCs', 'HARPCs', 'cyclic s', 'cyclic r', 'cyclic a']:
-        if pattern_type in comprehensive_stats[event]:
-            return comprehensive_stats[event][pattern_type]
-        else:
-            return default_stats
-    
-    if pattern_type not in comprehensive_stats[event]:
-        return default_stats
-    
-    if region_key is None or region_key not in comprehensive_stats[event][pattern_type]:
-        return default_stats
-    
-    return comprehensive_stats[event][pattern_type][region_key]
-
 def apply_comprehensive_table_formatting(ws, start_row, start_col, event_names):
     """Apply colors and formatting to the comprehensive table"""
-    colors = {
-        "Ascending": "A9D08E",
-        "Transverse": "BDD7EE", 
-        "Descending": "F8CBAD",
-        "Sigmoid": "D9D9D9",
-        "Rectum": "B1A0C7",
-        "Ascending - Rectum": "81BA5A", 
-        "Transverse - Rectum": "81B2DF",
-        "Descending - Rectum": "F2A16A",
-        "Sigmoid-Rectum": "BEBEBE"
-    }
+    colors = dict(REGION_COLORS)
+    colors["Ascending - Rectum"] = PAN_COLONIC_COLORS["Ascending"]
+    colors["Transverse - Rectum"] = PAN_COLONIC_COLORS["Transverse"]
+    colors["Descending - Rectum"] = PAN_COLONIC_COLORS["Descending"]
+    colors["Sigmoid-Rectum"] = PAN_COLONIC_COLORS["Sigmoid"]
     
     # Event header colors
     col_offset = 1
@@ -1079,18 +876,13 @@ def apply_comprehensive_table_formatting(ws, start_row, start_col, event_names):
         event_start_col = start_col + col_offset
         
         for col in range(event_start_col, event_start_col + 7):
-            cell = ws.cell(row=start_row, column=col)
-            cell.fill = PatternFill(start_color=event_color, end_color=event_color, fill_type="solid")
-            cell.alignment = Alignment(horizontal='center', vertical='center')
+            style_cell(ws.cell(row=start_row, column=col), event_color, centered=True)
         
         col_offset += 7
     
     # Metric header colors
-    metric_gray = "BFBFBF"
     for col in range(start_col, start_col + 1 + len(event_names) * 7):
-        cell = ws.cell(row=start_row + 1, column=col)
-        cell.fill = PatternFill(start_color=metric_gray, end_color=metric_gray, fill_type="solid")
-        cell.alignment = Alignment(horizontal='center', vertical='center')
+        style_cell(ws.cell(row=start_row + 1, column=col), HEADER_COLOR, centered=True)
     
     # Pattern type row colors
     current_row = start_row + 2
@@ -1102,14 +894,12 @@ def apply_comprehensive_table_formatting(ws, start_row, start_col, event_names):
     for pattern_type in pattern_types:
         for region in regions:
             if region in colors:
-                cell = ws.cell(row=current_row, column=start_col)
-                cell.fill = PatternFill(start_color=colors[region], end_color=colors[region], fill_type="solid")
+                style_cell(ws.cell(row=current_row, column=start_col), colors[region])
             current_row += 1
         
         for region_range in region_ranges:
             if region_range in colors:
-                cell = ws.cell(row=current_row, column=start_col)
-                cell.fill = PatternFill(start_color=colors[region_range], end_color=colors[region_range], fill_type="solid")
+                style_cell(ws.cell(row=current_row, column=start_col), colors[region_range])
             current_row += 1
         
         current_row += 1
@@ -1117,59 +907,118 @@ def apply_comprehensive_table_formatting(ws, start_row, start_col, event_names):
     current_row += 5
 
     special_pattern_rows = {
-        64: ("cyclic s", "F4B084"),
-        65: ("cyclic r", "F4B084"),  
-        66: ("cyclic a", "F4B084"),
-        67: ("HAPCs", "92D050"),
-        68: ("HARPCs", "FF0000")
+        64: ("cyclic s", PATTERN_COLOR),
+        65: ("cyclic r", PATTERN_COLOR),
+        66: ("cyclic a", PATTERN_COLOR),
+        67: ("HAPCs", HAPC_COLOR),
+        68: ("HARPCs", HARPC_COLOR)
     }
 
     for row_num, (pattern_type, color) in special_pattern_rows.items():
-        cell = ws.cell(row=row_num, column=start_col)
-        cell.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+        style_cell(ws.cell(row=row_num, column=start_col), color)
+
+def sequence_row_decoration(classified, index):
+    """Start and end region, broken sensors and highlight color (None if not a HAPC or HARPC) of a sequence row"""
+    if classified['is_hapc'][index]:
+        color = HAPC_COLOR
+    elif classified['is_harpc'][index]:
+        color = HARPC_COLOR
+    else:
+        color = None
+    broken_sensors = (np.flatnonzero(np.unpackbits(classified['broken'][index])) + 1).tolist()
+    return classified['starting_region'][index], classified['ending_region'][index], broken_sensors, color
+
+def write_sequence_row(ws, row_idx, classified, index):
+    starting_region, ending_region, broken_sensors, color = sequence_row_decoration(classified, index)
+
+    # Fill region columns
+    style_cell(ws.cell(row=row_idx, column=11, value=starting_region), REGION_COLORS[starting_region])
+    style_cell(ws.cell(row=row_idx, column=12, value=ending_region), REGION_COLORS[ending_region])
+
+    # Fill broken sensors (0 values) within the sequence
+    for sensor in broken_sensors:
+        ws.cell(row=row_idx, column=sensor + 13, value="broken")
+
+    # Color entire HAPCs/HARPCs, including broken sensors
+    if color:
+        for sensor in range(classified['first_sensor'][index], classified['last_sensor'][index] + 1):
+            style_cell(ws.cell(row=row_idx, column=sensor + 13), color)
+
+def stream_analysis_workbook(sheet, data, classified, timeline, report=None, cancel_event=None):
+    """Copy the top of the sheet into a write-only workbook and stream the sequence rows below it"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(SHEET_NAME)
+    for merged_range in sheet.merged_cells.ranges:
+        ws.merged_cells.add(merged_range.coord)
+
+    written_row = 0
+    for row in sheet.iter_rows(max_row=SEQUENCE_HEADER_ROW):
+        ws.append([copy_cell(ws, cell) for cell in row])
+        written_row += 1
+
+    first_row = classified['first_row']
+    rows = data.itertuples(index=False, name=None)
+    next_index = 0
+    last_row = timeline[-1][0] if timeline else 0
+
+    for row_idx, index, event in timeline:
+        if row_idx <= SEQUENCE_HEADER_ROW:
+            continue
+        if row_idx % PROGRESS_ROW_INTERVAL == 0:
+            check_cancelled(cancel_event)
+            if report:
+                report(f"Writing row {row_idx} of {last_row}", 0.85 + 0.1 * row_idx / last_row)
+
+        while written_row < row_idx - 1:
+            ws.append([])
+            written_row += 1
+
+        if event is not None:
+            hour, minute, second, event_name = event
+            values = [event_name, hour, minute, second] + [event_name] * 8
+            ws.append([styled_cell(ws, value, EVENT_COLOR) for value in values])
+        else:
+            # Skip to this row of the sequence table
+            for _ in range(index + first_row - next_index):
+                next(rows)
+            next_index = index + first_row + 1
+            values = [cell_value(value) for value in next(rows)]
+            values = values[:END_REGION_COLUMN - 1] + [None] * INSERTED_COLUMNS + values[END_REGION_COLUMN - 1:]
+            if classified['kind'][index] == SEQUENCE:
+                values = sequence_row_cells(ws, values, classified, index)
+            ws.append(values)
+        written_row += 1
 
-def get_sequence_range(row):
-    """Get the start and end sensor indices for the sequence (first to last non-zero sensor)"""
-    first_sensor = None
-    last_sensor = None
-    
-    for col_idx in range(13, min(len(row), 50)):
-        if (col_idx < len(row) and row[col_idx] and row[col_idx].value is not None and 
-            isinstance(row[col_idx].value, (int, float))):
-            sensor_idx = col_idx - 12
-            if row[col_idx].value > 0:
-                if first_sensor is None:
-                    first_sensor = sensor_idx
-                last_sensor = sensor_idx
-    
-    return first_sensor, last_sensor
+    return wb
 
-def fill_broken_sensors_in_sequence(ws, row_idx, row, first_sensor, last_sensor):
-    """Fill broken sensors (0 values) within sequence with 'broken' text"""
-    if first_sensor is None or last_sensor is None:
-        return
-    
-    for col_idx in range(13, min(len(row), 50)):
-        if col_idx < len(row):
-            sensor_idx = col_idx - 12
-            if first_sensor <= sensor_idx <= last_sensor:
-                cell = row[col_idx]
-                if (cell and cell.value is not None and 
-                    isinstance(cell.value, (int, float)) and cell.value == 0):
-                    # Fill with "broken" text
-                    ws.cell(row=row_idx, column=col_idx + 1, value="broken")
-
-def color_entire_sequence(ws, row_idx, row, first_sensor, last_sensor, color):
-    """Color the entire sequence range with the specified color"""
-    if first_sensor is None or last_sensor is None:
-        return
-    
-    fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
-    
-    for col_idx in range(13, min(len(row), 50)):
-        if col_idx < len(row):
-            sensor_idx = col_idx - 12
-            if first_sensor <= sensor_idx <= last_sensor:
-                excel_col = col_idx + 1
-                sensor_cell = ws.cell(row=row_idx, column=excel_col)
-                sensor_cell.fill = fill
\ No newline at end of file
+def sequence_row_cells(ws, values, classified, index):
+    """The cells of a streamed sequence row, with the same decoration write_sequence_row gives it"""
+    starting_region, ending_region, broken_sensors, color = sequence_row_decoration(classified, index)
+    values[10] = styled_cell(ws, starting_region, REGION_COLORS[starting_region])
+    values[11] = styled_cell(ws, ending_region, REGION_COLORS[ending_region])
+    for sensor in broken_sensors:
+        values[sensor + 12] = "broken"
+
+    if color:
+        last_sensor = classified['last_sensor'][index]
+        values += [None] * (last_sensor + 13 - len(values))
+        for sensor in range(classified['first_sensor'][index], last_sensor + 1):
+            values[sensor + 12] = styled_cell(ws, values[sensor + 12], color)
+    return values
+
+def styled_cell(ws, value, color):
+    return style_cell(WriteOnlyCell(ws, value=value), color)
+
+def copy_cell(ws, cell):
+    """A write-only copy of a cell of another workbook, None for empty cells"""
+    if cell.value is None and not cell.has_style:
+        return None
+    target = WriteOnlyCell(ws, value=cell.value)
+    if cell.has_style:
+        target.font = copy(cell.font)
+        target.fill = copy(cell.fill)
+        target.border = copy(cell.border)
+        target.alignment = copy(cell.alignment)
+        target.number_format = cell.number_format
+        target.protection = copy(cell.protection)
+    return target
@@ -3,7 +3,7 @@ from exportToExcelScreen.export import exportToXlsx
 from utils import clear_screen
 from exportToExcelScreen.events import create_event_interface, show_comments
 from exportToExcelScreen.sensors import create_sensors_frame
-from exportToExcelScreen.importFile import select_input_file
+from exportToExcelScreen.importFile import select_input_file, use_detected_patterns
 
 
 def export_to_excel_screen(root, go_back_func, create_main_screen_func):
@@ -19,17 +19,35 @@ def export_to_excel_screen(root, go_back_func, create_main_screen_func):
 
     df = None
     file_name = None
+    # Cancel event of the input file being read in the background, if any
+    import_job = {}
+
+    def file_loaded(new_df, new_file_name):
+        nonlocal df, file_name
+        df, file_name = new_df, new_file_name
+
+    def cancel_import():
+        if import_job.get("cancel") is not None:
+            import_job["cancel"].set()
 
     def select_file_and_update_label():
+        cancel_import()
+        import_job["cancel"] = select_input_file(root, file_label, button_export, file_loaded)
+
+    def use_detection_and_update_label():
         nonlocal df, file_name
-        df, file_name = select_input_file(root, file_label, button_export)
+        cancel_import()
+        df, file_name = use_detected_patterns(file_label, button_export)
 
     # Top Buttons
     button_select_input = ctk.CTkButton(main_frame, text="Select Input File", command=lambda: select_file_and_update_label())
     button_select_input.grid(row=1, column=0, padx=10, pady=10, sticky="ew")
 
+    button_use_detection = ctk.CTkButton(main_frame, text="Use Detected Patterns", command=use_detection_and_update_label)
+    button_use_detection.grid(row=1, column=1, padx=10, pady=10, sticky="ew")
+
     file_label = ctk.CTkLabel(main_frame, text="No file selected", font=("Arial", 12))
-    file_label.grid(row=1, column=1, columnspan=3, padx=10, pady=10, sticky="ew")
+    file_label.grid(row=1, column=2, padx=10, pady=10, sticky="ew")
 
     # Sensors Frame
     sensors_frame = ctk.CTkFrame(main_frame, border_width=1, border_color="gray")
@@ -47,18 +65,42 @@ def export_to_excel_screen(root, go_back_func, create_main_screen_func):
     create_event_interface(events_frame)
     events, first_event_field = show_comments(events_frame)
     
+    # Cancel event of the export running in the background, if any
+    export_job = {}
+
+    def start_export():
+        export_job["cancel"] = exportToXlsx(df, file_name, sliders, events, settings_sliders, pattern_params, first_event_field,
+                                            button_export, button_cancel, progress_bar, progress_label)
+
+    def cancel_export():
+        if export_job.get("cancel") is not None:
+            export_job["cancel"].set()
+
     # Define a function that resets events and then navigates back
     def reset_and_go_back():
         from exportToExcelScreen.events import reset_events, get_first_event_name
+        cancel_import()
+        cancel_export()
         reset_events(events_frame)
         go_back_func(root, create_main_screen_func)
 
     # Bottom Buttons
-    button_export = ctk.CTkButton(main_frame, text="Export", command=lambda: exportToXlsx(df, file_name, sliders, events, settings_sliders, pattern_params, first_event_field), state='disabled')
+    button_export = ctk.CTkButton(main_frame, text="Export", command=start_export, state='disabled')
     button_export.grid(row=3, column=0, columnspan=3, pady=10, sticky="ew")
 
+    # Export progress
+    progress_bar = ctk.CTkProgressBar(main_frame)
+    progress_bar.set(0)
+    progress_bar.grid(row=4, column=0, columnspan=2, padx=10, pady=10, sticky="ew")
+
+    button_cancel = ctk.CTkButton(main_frame, text="Cancel", command=cancel_export, state='disabled')
+    button_cancel.grid(row=4, column=2, padx=10, pady=10, sticky="ew")
+
+    progress_label = ctk.CTkLabel(main_frame, text="", font=("Arial", 12))
+    progress_label.grid(row=5, column=0, columnspan=3, padx=10, sticky="ew")
+
     button_back = ctk.CTkButton(main_frame, text="Back", command=reset_and_go_back)  # Updated this line
-    button_back.grid(row=4, column=0, columnspan=3, pady=10, sticky="ew")
+    button_back.grid(row=6, column=0, columnspan=3, pady=10, sticky="ew")
 
     # Configure grid weights for responsiveness
     main_frame.grid_columnconfigure(0, weight=1)
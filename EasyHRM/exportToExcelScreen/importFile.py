@@ -1,30 +1,133 @@
+import os
+import numpy as np
 import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from pandas.io.parsers import TextParser
 from tkinter import filedialog
+from utils import run_in_background, check_cancelled, TaskCancelled
+from exportToExcelScreen.detected import detected_sequence_table
 
+# Rows read between two progress updates
+READ_PROGRESS_ROWS = 2000
+# Workbook formats openpyxl reads, older .xls files go through pd.read_excel's own engine
+OPENPYXL_EXTENSIONS = (".xlsx", ".xlsm")
 
-def select_input_file(root, label, button_export):
+def convert_cell(value):
+    """A cell value the way pandas' openpyxl reader hands it to the parser"""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    if isinstance(value, str) and value in ERROR_CODES:
+        return np.nan
+    return value
+
+def read_plothrm_export(file_path, report=None, cancel_event=None):
+    """Read the first sheet of a plotHRM export into the same DataFrame as pd.read_excel.
+
+    .xlsx and .xlsm sheets are streamed with openpyxl in read-only mode, taking plain values
+    instead of cell objects, and pandas only infers the column types. Other formats such as
+    .xls are left to pd.read_excel.
+    """
+    if os.path.splitext(file_path)[1].lower() not in OPENPYXL_EXTENSIONS:
+        return pd.read_excel(file_path)
+
+    wb = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = wb.worksheets[0]
+        total_rows = sheet.max_row
+        sheet.reset_dimensions()
+
+        data = []
+        last_row_with_data = -1
+        for row_number, row in enumerate(sheet.iter_rows(values_only=True)):
+            converted_row = [convert_cell(value) for value in row]
+            while converted_row and converted_row[-1] == "":
+                converted_row.pop()
+            if converted_row:
+                last_row_with_data = row_number
+            data.append(converted_row)
+
+            if row_number % READ_PROGRESS_ROWS == 0:
+                check_cancelled(cancel_event)
+                if report:
+                    report(f"Read {row_number} of {total_rows} rows", row_number / total_rows if total_rows else None)
+    finally:
+        wb.close()
+
+    # Trim trailing empty rows and extend the others to the widest row
+    data = data[:last_row_with_data + 1]
+    width = max((len(row) for row in data), default=0)
+    data = [row + [""] * (width - len(row)) for row in data]
+    if not data:
+        return pd.DataFrame()
+    return TextParser(data, header=0, skip_blank_lines=False).read()
+
+def select_input_file(root, label, button_export, on_loaded):
+    """Ask for a plotHRM export and read it on a worker thread.
+
+    on_loaded(df, file_name) runs on the Tk thread once the file is read, with (None, None)
+    when reading failed. Returns the event that cancels the read, None if no file was chosen.
+    """
     # Open file dialog and ask user to select an Excel file
     file_path = filedialog.askopenfilename(
         filetypes=[("Excel files", "*.xlsx;*.xls")],
         title="Select an Excel File"
     )
-    
+
     # Check if a file was selected
     if not file_path:
         print("No file selected.")
         label.configure(text="No file selected")
         button_export.configure(state='disabled')
-        return None, None
+        return None
 
-    # Read the Excel file into a DataFrame
-    try:
-        df = pd.read_excel(file_path)
+    file_name = file_path.split('/')[-1]
+    label.configure(text=f"Reading {file_name}...")
+    button_export.configure(state='disabled')
+
+    def work(report, cancel_event):
+        return read_plothrm_export(file_path, report, cancel_event)
+
+    def on_progress(message, fraction):
+        if label.winfo_exists():
+            label.configure(text=f"Reading {file_name}: {message}")
+
+    def on_done(df):
         print(f"File {file_path} read successfully.")
-        # Display the selected file name
-        label.configure(text=f"Selected File: {file_path.split('/')[-1]}")
-        file_name = file_path.split('/')[-1]
-        button_export.configure(state='normal')
-        return df, file_name
-    except Exception as e:
-        print(f"Error reading file: {e}")
+        if label.winfo_exists():
+            # Display the selected file name
+            label.configure(text=f"Selected File: {file_name}")
+            button_export.configure(state='normal')
+        on_loaded(df, file_name)
+
+    def on_error(error):
+        if isinstance(error, TaskCancelled):
+            return
+        print(f"Error reading file: {error}")
+        if label.winfo_exists():
+            label.configure(text=f"Could not read {file_name}")
+        on_loaded(None, None)
+
+    # Large workbooks take a while to read, so the window keeps responding meanwhile
+    return run_in_background(label, work, on_progress, on_done, on_error)
+
+def use_detected_patterns(label, button_export):
+    """Analyse the patterns of the last detection without going through a plotHRM export"""
+    from patternDetectionScreen import detect_and_export_2 as detection
+
+    detector = detection.detector
+    if detector is None or not len(detector.result):
+        print("No detected patterns.")
+        label.configure(text="No detected patterns, run Detect Events first")
+        button_export.configure(state='disabled')
         return None, None
+
+    columns = detector.sensor_columns()
+    df = detected_sequence_table(detector.result, detector.distance_between_sensors, columns.stop - columns.start,
+                                 detector.input_file_path)
+    file_name = os.path.basename(detector.input_file_path)
+    label.configure(text=f"Detected Patterns: {file_name} ({len(detector.result)} patterns)")
+    button_export.configure(state='normal')
+    return df, file_name
@@ -0,0 +1,65 @@
+from functools import lru_cache
+from openpyxl.styles import Alignment, NamedStyle, PatternFill
+from openpyxl.styles.borders import DEFAULT_BORDER
+from openpyxl.styles.fonts import DEFAULT_FONT
+
+EVENT_COLOR = "F0FC5A"
+HAPC_COLOR = "92D050"
+HARPC_COLOR = "FF0000"
+HEADER_COLOR = "BFBFBF"
+SENSOR_HEADER_COLOR = "F2F2F2"
+PATTERN_COLOR = "F4B084"
+ALTERNATING_EVENT_COLORS = [EVENT_COLOR, "FDE9D9"]
+REGION_COLORS = {
+    "Ascending": "A9D08E",
+    "Transverse": "BDD7EE",
+    "Descending": "F8CBAD",
+    "Sigmoid": "D9D9D9",
+    "Rectum": "B1A0C7"
+}
+# Patterns that reach the rectum from each region
+PAN_COLONIC_COLORS = {
+    "Ascending": "81BA5A",
+    "Transverse": "81B2DF",
+    "Descending": "F2A16A",
+    "Sigmoid": "BEBEBE"
+}
+
+# Shared style objects, openpyxl only registers each of them once per workbook
+CENTERED = Alignment(horizontal='center', vertical='center')
+
+@lru_cache(maxsize=None)
+def solid_fill(color):
+    return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+@lru_cache(maxsize=None)
+def style_name(color, centered):
+    return f"EasyHRM {color or 'no fill'}{' centered' if centered else ''}"
+
+def named_style(color, centered):
+    """Named style with a solid fill and/or centered alignment over the default look of a cell"""
+    return NamedStyle(style_name(color, centered), font=DEFAULT_FONT, border=DEFAULT_BORDER,
+                      fill=solid_fill(color) if color else PatternFill(), alignment=CENTERED if centered else Alignment(),
+                      number_format="General")
+
+def style_cell(cell, color=None, centered=False):
+    """Give a cell a solid fill and/or centered alignment, keeping the rest of its style.
+
+    Cells without a style yet, most of the analysis sheet, take a named style that openpyxl
+    resolves once per workbook; styled cells get the shared fill and alignment one by one.
+    """
+    if not color and not centered:
+        return cell
+    if not cell.has_style:
+        try:
+            cell.style = style_name(color, centered)
+        except ValueError:
+            # First use in this workbook
+            cell.parent.parent.add_named_style(named_style(color, centered))
+            cell.style = style_name(color, centered)
+        return cell
+    if color:
+        cell.fill = solid_fill(color)
+    if centered:
+        cell.alignment = CENTERED
+    return cell
@@ -4,6 +4,7 @@ from patternDetectionScreen.patternDetectionScreen import open_screen_for_patter
 from utils import go_back, toggle_mode
 import sys
 import os
+import multiprocessing
 from PIL import Image
 
 import utils
@@ -113,6 +114,8 @@ def build_main_screen(app):
 
 # Run the main screen
 if __name__ == "__main__":
+    # Needed for the detection process pool in the frozen (PyInstaller) build
+    multiprocessing.freeze_support()
     app = create_main_window()
     build_main_screen(app)
     app.mainloop()
@@ -4,6 +4,7 @@ import pandas as pd
 import numpy as np
 from utils import sequences_to_xml, write_xml_to_file, convertTime, validateTime, show_info_popup
 from tkinter import filedialog
+from patternDetectionScreen.recording import load_recording, repair_broken_sensors, write_recording
 
 global result
 result = []
@@ -39,43 +40,26 @@ def import_txt_file_detection(file_label, button_export, button_approximate, but
     return input_file_path
 
 def approximate_broken_sensor(broken_sensor_entries):
-    # Read the data from the file
-    with open(input_file_path, 'r') as file:
-        lines = file.readlines()
-    
-    # Initialize an empty list to hold the processed data
-    data = []
-    
-    # Process each line in the file
-    for line in lines:
-        if line.strip():  # Skip any empty lines
-            parts = line.split()
-            time = float(parts[0])  # Convert the first column to float for time
-            sensors = list(map(int, parts[1:]))  # Convert the rest to integers for sensor values
-            data.append([time] + sensors)
-    
-    # Convert the list to a numpy array for easier manipulation
-    data = np.array(data, dtype=object)
-    
+    # Load the recording numerically (served from the cache next to the file when possible)
+    times, sensor_values = load_recording(input_file_path)
+
+    broken_columns = []
     for broken_sensor in broken_sensor_entries:
         if not broken_sensor.get().strip(' ') == '':
             broken_sensor_index = int(broken_sensor.get())
-            # Replace the broken sensor values with the average of the previous and next sensor values
-            for row in data:
-                if broken_sensor_index == 1:
-                    row[broken_sensor_index] = row[broken_sensor_index + 1]
-                elif broken_sensor_index == len(row) - 1:
-                    row[broken_sensor_index] = row[broken_sensor_index - 1]
-                else:
-                    row[broken_sensor_index] = int(round((row[broken_sensor_index-1] + row[broken_sensor_index + 1]) / 2))
+            if 1 <= broken_sensor_index <= sensor_values.shape[1]:
+                broken_columns.append(broken_sensor_index - 1)
+
+    # Replace the broken sensor values by interpolating between the nearest healthy sensors
+    repaired = repair_broken_sensors(sensor_values, broken_columns)
 
     # Prompt the user to select where to save the new file
     save_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text files", "*.txt")], initialfile = f"{filename.split('.txt')[0]}_approximated.txt")
-    
+    if not save_path:
+        return
+
     # Save the modified data back to the file or return it
-    with open(save_path, 'w') as file:
-        for row in data:
-            file.write(f"{row[0]:.1f} " + ' '.join(map(str, map(int, row[1:]))) + '\n')
+    write_recording(save_path, times, repaired, " ", " ", time_strings=["%.1f" % time for time in times.tolist()])
 
     print(f"File saved as: {save_path}")
 
@@ -87,19 +71,17 @@ def read_data(total_seconds):
     global result
     result = []
 
-    data = pd.read_csv(input_file_path, delim_whitespace=True, header=None)
+    # Load the recording (parsed once, then served from the cache next to the file)
+    times, sensor_values = load_recording(input_file_path)
 
-    # Rename the columns: time and sensors
-    data.columns = ['time'] + [f'sensor_{i}' for i in range(1, 42)]
+    # Keep rows where the time has a decimal part of .0 and that come after the start time
+    rows = (times == np.trunc(times)) & (times > total_seconds)
 
-    # Keep rows where the time has a decimal part of .0
-    data = data[data['time'] == data['time'].astype(int)]
-
-    # Filter out rows where the time is 7800 seconds or below
-    data = data[data['time'] > total_seconds]
+    # Rename the columns: time and sensors
+    data = pd.DataFrame(sensor_values[rows], columns=[f'sensor_{i}' for i in range(1, 42)])
 
     # Remove the decimal part from the time
-    data['time'] = data['time'].astype(int)
+    data.insert(0, 'time', times[rows].astype(int))
 
 def find_patterns(chunk):
     patterns = []
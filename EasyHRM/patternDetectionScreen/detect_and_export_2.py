@@ -1,55 +1,17 @@
 import os
-from utils import process_sequences
-import pandas as pd
-from utils import sequences_to_xml, write_xml_to_file, convertTime, validateTime, show_info_popup
+from copy import copy
+from utils import ask_sequences_save_path, convertTime, validateTime, show_info_popup
+from utils import run_in_background, TaskCancelled
 from tkinter import filedialog
-import numpy as np
-from scipy.ndimage import label
+from patternDetectionScreen.detector import PatternDetector
+from patternDetectionScreen.recording import load_recording, repair_broken_sensors, write_recording
 
-global result
-result = []
-
-# Read the input file into a DataFrame
+# Recording selected on the Pattern Detection screen
 global input_file_path
 input_file_path = ''
 
-visible_sensors = (1,40)
-detection_threshold = 100
-zone_threshold = 100
-min_pattern_length = 3
-maximum_chunk_size = 30
-distance_between_sensors = 25
-
-timestamps = pd.DataFrame()
-values = pd.DataFrame()
-global mask
-
-
-# Define a custom structure for labeling with diagonal connections
-structure = np.array([[1, 1, 1],
-                      [1, 1, 1],
-                      [1, 1, 1]])
-
-def split_continuous_sensors(patterns):
-    continuous_segments = []
-    current_segment = []
-
-    for i, pattern in enumerate(patterns):
-        if not current_segment:
-            current_segment.append(pattern)
-        else:
-            last_sensor_number = int(current_segment[-1][1].split('_')[1])
-            current_sensor_number = int(pattern[1].split('_')[1])
-            if current_sensor_number == last_sensor_number + 1:
-                current_segment.append(pattern)
-            else:
-                continuous_segments.append(current_segment)
-                current_segment = [pattern]
-    if current_segment:
-        continuous_segments.append(current_segment)
-
-    filtered_segments = [segment for segment in continuous_segments if len(segment) >= min_pattern_length]
-    return filtered_segments
+# Detector of the last completed detection, its cache is handed on so later runs only recompute changed settings
+detector = None
 
 def import_txt_file_detection(file_label, button_export, button_approximate, button_detect_events):
     file_path = filedialog.askopenfilename(filetypes=[("Text files", "*.txt")])
@@ -70,129 +32,40 @@ def import_txt_file_detection(file_label, button_export, button_approximate, but
         print("No file selected.")
     return input_file_path
 
-def approximate_broken_sensor(broken_sensor_entries):
-    # Read the data from the file
-    with open(input_file_path, 'r') as file:
-        lines = file.readlines()
-    
-    # Initialize an empty list to hold the processed data
-    data = []
-    
-    # Process each line in the file
-    for line in lines:
-        if line.strip():  # Skip any empty lines
-            parts = line.split()
-            time = float(parts[0])  # Convert the first column to float for time
-            sensors = list(map(int, parts[1:]))  # Convert the rest to integers for sensor values
-            data.append([time] + sensors)
-    
-    # Convert the list to a numpy array for easier manipulation
-    data = np.array(data, dtype=object)
-    
+def read_broken_sensors(broken_sensor_entries):
+    """Sensor numbers typed in the broken sensor entries, skipping empty and invalid ones"""
+    broken_sensors = []
     for broken_sensor in broken_sensor_entries:
-        if not broken_sensor.get().strip(' ') == '':
-            broken_sensor_index = int(broken_sensor.get())
-            # Replace the broken sensor values with the average of the previous and next sensor values
-            for row in data:
-                if broken_sensor_index == 1:
-                    row[broken_sensor_index+1] = row[broken_sensor_index+2]
-                elif broken_sensor_index == len(row) - 2:
-                    row[broken_sensor_index+1] = row[broken_sensor_index]
-                else:
-                    row[broken_sensor_index+1] = int(round((row[broken_sensor_index] + row[broken_sensor_index+2]) / 2))
+        text = broken_sensor.get().strip(' ')
+        if text == '':
+            continue
+        try:
+            broken_sensors.append(int(text))
+        except ValueError:
+            print(f"Invalid broken sensor: {text}")
+    return broken_sensors
+
+def approximate_broken_sensor(broken_sensor_entries):
+    # Load the recording numerically (served from the cache next to the file when possible)
+    times, sensor_values = load_recording(input_file_path)
+
+    # Sensor n is column n of the sensor matrix, column 0 is not a sensor
+    broken_sensors = [sensor for sensor in read_broken_sensors(broken_sensor_entries)
+                      if 1 <= sensor < sensor_values.shape[1]]
+    repaired = repair_broken_sensors(sensor_values, broken_sensors, first_sensor_column=1)
 
     # Prompt the user to select where to save the new file
     save_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text files", "*.txt")], initialfile = f"{filename.split('.txt')[0]}_approximated.txt")
-    
-    # Save the modified data back to the file in the same format
-    with open(save_path, 'w') as file:
-        for row in data:
-            # Format row[0] and strip '.0' if necessary
-            row_0_str = f"{row[0]:.1f}".rstrip('0').rstrip('.') if row[0] % 1 == 0 else f"{row[0]:.1f}"
-            formatted_row = f"{row_0_str}\t\t {row[1]:d}"
-            for value in row[2:]:
-                formatted_row += f"\t {value:d}"
-            file.write(formatted_row + '\n')
+    if not save_path:
+        return
 
-    print(f"File saved as: {save_path}")
+    # Save the modified data in the same format
+    write_recording(save_path, times, repaired)
 
-def read_data(total_seconds):
-    # Read the data into a DataFrame
-    global dataframe
-
-    dataframe = pd.read_csv(input_file_path, sep=" ", header=None)
-
-    dataframe.iloc[:, 0] = pd.to_numeric(dataframe.iloc[:, 0], errors='coerce')
-    dataframe = dataframe[dataframe.iloc[:, 0] > total_seconds]
-
-    # Remove milliseconds from timestamps
-    dataframe = dataframe[dataframe[0] == dataframe[0].astype(int)]
-
-    # Separate the timestamps and the values
-    global timestamps
-    timestamps = dataframe.iloc[:, 0]
-    global values
-    values = dataframe.iloc[:, 1:]
-
-    # Keep only the visible sensors
-    values = values.iloc[:, int(round(visible_sensors[0]))-1:int(round(visible_sensors[1]))]
-
-    # Create a mask where values are greater than the threshold
-    global mask
-    mask = values > zone_threshold
-
-
-def find_patterns(zone_df):
-    patterns = []
-    for sensor_id, group in zone_df.groupby('Sensor_ID'):
-        max_sensor_value = group['Value'].max()
-        sensor_timestamp = group.loc[group['Value'].idxmax(), 'Timestamp']
-        if max_sensor_value > detection_threshold:
-            pattern = (sensor_timestamp, f'sensor_{sensor_id}', max_sensor_value)
-            patterns.append(pattern)
-    return patterns
-
-def define_chunks_and_get_patterns():
-    # Use the label function to find connected regions
-    labeled_array, num_features = label(mask, structure)
-
-    # Extract the zones, their values, timestamps, and sensor IDs
-    results = {}
-    for zone in range(1, num_features + 1):
-        zone_indices = np.argwhere(labeled_array == zone)
-        zone_data = [(timestamps.iloc[i], j + 1, values.iloc[i, j]) for i, j in zone_indices]  # j + 1 to get the sensor_id starting from 1
-        results[zone] = zone_data
-    
-    global result
-    result = []
-    # Detect patterns in each zone
-    for zone, data in results.items():
-        zone_df = pd.DataFrame(data, columns=['Timestamp', 'Sensor_ID', 'Value'])
-        zone_patterns = find_patterns(zone_df)
-        split_zone_patterns = split_continuous_sensors(zone_patterns)
-
-        if split_zone_patterns:
-            for pattern in split_zone_patterns:
-                if len(pattern) >= min_pattern_length:
-                    result.append(pattern)
-    return result
-
-def compute_patterns(sliders, advanced_sliders, time_entries, settings_frame, button_export):
-    global detection_threshold
-    detection_threshold = int(round(advanced_sliders[0].get()))
-
-    global min_pattern_length
-    min_pattern_length = int(round(advanced_sliders[1].get()))
-    
-    global distance_between_sensors
-    distance_between_sensors = int(round(advanced_sliders[2].get()))
-
-    global zone_threshold
-    zone_threshold = int(round(advanced_sliders[3].get()))
-
-    global visible_sensors
-    visible_sensors = sliders[0].get()
+    print(f"File saved as: {save_path}")
 
+def read_detection_settings(sliders, advanced_sliders, time_entries, broken_sensor_entries):
+    """Read the detection settings from the widgets, returns None when the start time is invalid"""
     # Extract time from entries
     hour = time_entries[0].get() or 0
     minute = time_entries[1].get() or 0
@@ -200,21 +73,87 @@ def compute_patterns(sliders, advanced_sliders, time_entries, settings_frame, bu
     time_string = f"{hour}:{minute}:{second}"
 
     # Validate and convert time
-    if validateTime(time_string):
-        total_seconds = round(convertTime(time_string) / 10)
-    else:
+    if not validateTime(time_string):
         print("Invalid time format")
-    
-    read_data(total_seconds)
-
-    global result
-    result = define_chunks_and_get_patterns()
-    show_info_popup("Succes", "Detection Completed", settings_frame)
-
-    #Enable export button after detection
-    button_export.configure(state='normal')
+        return None
+
+    return dict(
+        visible_sensors=sliders[0].get(),
+        detection_threshold=int(round(advanced_sliders[0].get())),
+        min_pattern_length=int(round(advanced_sliders[1].get())),
+        distance_between_sensors=int(round(advanced_sliders[2].get())),
+        zone_threshold=int(round(advanced_sliders[3].get())),
+        start_seconds=round(convertTime(time_string) / 10),
+        # Broken sensors are repaired in memory, the repaired file is only written by approximate_broken_sensor
+        broken_sensors=read_broken_sensors(broken_sensor_entries),
+    )
+
+def compute_patterns(sliders, advanced_sliders, time_entries, broken_sensor_entries, settings_frame, button_export,
+                     button_detect_events, button_cancel, progress_bar, progress_label):
+    settings = read_detection_settings(sliders, advanced_sliders, time_entries, broken_sensor_entries)
+    if settings is None:
+        show_info_popup("Error", "You must enter the right format of time (HH:MM:SS)", settings_frame)
+        return None
+
+    # Every run works on its own detector, so a cancelled run still finishing in the background
+    # never changes the cache or the result another run or the Data Analysis screen is reading
+    if detector is None or detector.input_file_path != input_file_path:
+        run = PatternDetector(input_file_path)
+    else:
+        run = copy(detector)
+    run.update(**settings)
+
+    button_detect_events.configure(state='disabled')
+    button_export.configure(state='disabled')
+    button_cancel.configure(state='normal')
+    progress_bar.set(0)
+
+    def finish(message):
+        if not progress_label.winfo_exists():
+            return
+        progress_bar.configure(mode="determinate")
+        progress_bar.stop()
+        progress_label.configure(text=message)
+        button_detect_events.configure(state='normal')
+        button_cancel.configure(state='disabled')
+
+    def on_progress(message, fraction):
+        if not progress_label.winfo_exists():
+            return
+        progress_label.configure(text=message)
+        if fraction is None:
+            if progress_bar.cget("mode") != "indeterminate":
+                progress_bar.configure(mode="indeterminate")
+                progress_bar.start()
+        else:
+            progress_bar.set(fraction)
+
+    def on_done(patterns):
+        global detector
+        detector = run
+        finish(f"Detection completed: {detector.summary()}")
+        if not settings_frame.winfo_exists():
+            return
+        show_info_popup("Succes", "Detection Completed", settings_frame)
+
+        #Enable export button after detection
+        button_export.configure(state='normal')
+
+    def on_error(error):
+        if isinstance(error, TaskCancelled):
+            finish("Detection cancelled")
+            return
+        print(f"Error during detection: {error}")
+        finish("Detection failed")
+        if settings_frame.winfo_exists():
+            show_info_popup("Error", f"Detection failed: {error}", settings_frame)
+
+    # Detection runs on a worker thread so the window keeps responding
+    return run_in_background(settings_frame, run.detect, on_progress, on_done, on_error)
 
 def exportToXML():
-    sequences = process_sequences(result)
-    xml_output = sequences_to_xml(sequences, distance_between_sensors)
-    write_xml_to_file(xml_output, filename)
\ No newline at end of file
+    save_path = ask_sequences_save_path(filename)
+    if not save_path:
+        return
+    detector.export(save_path)
+    print("XML file 'hrm_output' has been created.")
\ No newline at end of file
@@ -0,0 +1,429 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.ndimage import label
+from utils import save_sequences_file, check_cancelled
+from sequences import DetectedSequences
+from patternDetectionScreen.recording import load_recording, iter_recording_blocks, repair_broken_sensors, PARSE_BLOCK_ROWS
+
+# Recordings bigger than this are detected block by block instead of being loaded at once
+STREAMING_FILE_SIZE = 1024 ** 3
+
+# Recordings with at least this many whole-second rows are detected on a process pool
+PARALLEL_MIN_ROWS = 6 * 3600
+PARTITIONS_PER_WORKER = 4
+
+# Define a custom structure for labeling with diagonal connections
+structure = np.array([[1, 1, 1],
+                      [1, 1, 1],
+                      [1, 1, 1]])
+
+def peak_entries(zones, sensors, rows, peaks):
+    """Indices of the peak of every (zone, sensor) pair, sorted by zone and sensor.
+
+    When a sensor reaches its maximum more than once inside a zone, the earliest row wins.
+    """
+    # Sort by zone, sensor, descending value and row so each group starts with its peak
+    order = np.lexsort((rows, -peaks, sensors, zones))
+    zones, sensors = zones[order], sensors[order]
+
+    first = np.ones(len(zones), dtype=bool)
+    first[1:] = (zones[1:] != zones[:-1]) | (sensors[1:] != sensors[:-1])
+    return order[first]
+
+def find_zone_peaks(labeled_array, values):
+    """Return the peak of every (zone, sensor) pair as arrays sorted by zone and sensor"""
+    labels = labeled_array.ravel()
+    cells = np.flatnonzero(labels)
+    zones = labels[cells]
+    rows, sensors = np.divmod(cells, labeled_array.shape[1])
+    peaks = values[rows, sensors]
+
+    entries = peak_entries(zones, sensors, rows, peaks)
+    return zones[entries], sensors[entries], rows[entries], peaks[entries]
+
+def group_zone_patterns(zones, sensors, rows, peaks, timestamps, detection_threshold, min_pattern_length):
+    """Split the zone peaks above the detection threshold into runs of neighbouring sensors"""
+    keep = peaks > detection_threshold
+    zones, sensors, rows, peaks = zones[keep], sensors[keep], rows[keep], peaks[keep]
+
+    # A run ends where the zone changes or the next sensor is not directly adjacent
+    breaks = np.flatnonzero((zones[1:] != zones[:-1]) | (sensors[1:] != sensors[:-1] + 1)) + 1
+    bounds = np.concatenate(([0], breaks, [len(zones)]))
+
+    # Keep the runs that are long enough
+    lengths = np.diff(bounds)
+    long_runs = (lengths >= min_pattern_length) & (lengths > 0)
+    entries = np.repeat(long_runs, lengths)
+    return DetectedSequences.from_peaks(timestamps[rows[entries]], sensors[entries], peaks[entries], lengths[long_runs])
+
+def zone_peaks(zone_mask, zone_values):
+    """Label the zones of the mask and return the peak of every (zone, sensor) pair"""
+    # Use the label function to find connected regions
+    labeled_array, num_features = label(zone_mask, structure)
+    return find_zone_peaks(labeled_array, zone_values)
+
+def join_zone_peaks(parts):
+    """Join the zone peaks of consecutive row ranges given as (peaks, first row) pairs.
+
+    The zones of each range are numbered after those of the previous range, which keeps
+    the order a single labelling of all rows would give.
+    """
+    joined = [[], [], [], []]
+    zone_offset = 0
+    for (zones, sensors, rows, peaks), first_row in parts:
+        joined[0].append(zones.astype(np.int64) + zone_offset)
+        joined[1].append(sensors)
+        joined[2].append(rows + first_row)
+        joined[3].append(peaks)
+        if len(zones):
+            zone_offset += int(zones.max())
+    return tuple(np.concatenate(arrays) for arrays in joined)
+
+def partition_rows(zone_mask, partitions):
+    """Split the rows into about `partitions` ranges that each end on a quiet row.
+
+    No zone can cross a row where every sensor is below the zone threshold, so the
+    ranges can be labelled independently without splitting a zone in two.
+    """
+    quiet_rows = np.flatnonzero(~zone_mask.any(axis=1))
+    total_rows = len(zone_mask)
+
+    targets = np.arange(1, partitions) * total_rows // partitions
+    positions = np.searchsorted(quiet_rows, targets)
+    cuts = quiet_rows[positions[positions < len(quiet_rows)]] + 1
+
+    bounds = np.unique(np.concatenate(([0], cuts, [total_rows])))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def parallel_zone_peaks(zone_mask, zone_values, workers=None, report=None, cancel_event=None):
+    """Label time partitions of the recording on a process pool and join their zone peaks"""
+    workers = workers or os.cpu_count() or 1
+    ranges = partition_rows(zone_mask, workers * PARTITIONS_PER_WORKER)
+    if workers < 2 or len(ranges) < 2:
+        return zone_peaks(zone_mask, zone_values)
+
+    parts = []
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(ranges)))
+    try:
+        futures = [pool.submit(zone_peaks, zone_mask[start:stop], zone_values[start:stop]) for start, stop in ranges]
+        # Partitions are in time order, so joining them keeps the serial zone order
+        for done, (future, (start, stop)) in enumerate(zip(futures, ranges), start=1):
+            parts.append((future.result(), start))
+            check_cancelled(cancel_event)
+            if report:
+                report(f"Labelled {done}/{len(futures)} partitions", done / len(futures))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return join_zone_peaks(parts)
+
+class StreamedZones:
+    """Zone peaks of a recording labelled one block of rows at a time.
+
+    Between blocks only the zones of the last row are kept. Zones of the next block that
+    touch them across the seam are merged into one with a union-find over all zones, so
+    a zone may span any number of blocks. Only peaks above the detection threshold are
+    kept, which makes memory follow the number of patterns instead of the recording.
+    """
+
+    def __init__(self, detection_threshold):
+        self.detection_threshold = detection_threshold
+        self.parent = []
+        # Flat index (row * sensors + sensor) of the first cell of every zone, the order a single labelling numbers zones in
+        self.first_cells = []
+        # Zone of every sensor on the last row seen, -1 where there is none
+        self.seam = None
+        self.rows = 0
+        self.parts = []
+
+    def count(self):
+        return len(self.parent)
+
+    def find(self, zone):
+        while self.parent[zone] != zone:
+            self.parent[zone] = self.parent[self.parent[zone]]
+            zone = self.parent[zone]
+        return zone
+
+    def add(self, zone_mask, zone_values, timestamps):
+        """Label the next block of rows and stitch it to the rows before it"""
+        if len(zone_mask) == 0:
+            return
+        labeled_array, num_features = label(zone_mask, structure)
+        first_zone = len(self.parent) - 1
+        self.parent.extend(range(first_zone + 1, first_zone + 1 + num_features))
+
+        if num_features:
+            labels, first_cells = np.unique(labeled_array.ravel(), return_index=True)
+            self.first_cells.extend((first_cells[labels > 0] + self.rows * zone_mask.shape[1]).tolist())
+
+        # A cell of the first row touches the three nearest cells of the last row before it
+        if self.seam is not None:
+            top = labeled_array[0]
+            width = len(top)
+            for shift in (-1, 0, 1):
+                sensors = np.arange(max(0, -shift), min(width, width - shift))
+                touching = (top[sensors] > 0) & (self.seam[sensors + shift] >= 0)
+                for zone, previous in zip((top[sensors][touching] + first_zone).tolist(),
+                                          self.seam[sensors + shift][touching].tolist()):
+                    zone, previous = self.find(zone), self.find(previous)
+                    if zone != previous:
+                        self.parent[max(zone, previous)] = min(zone, previous)
+        self.seam = np.where(labeled_array[-1] > 0, labeled_array[-1] + first_zone, -1)
+
+        zones, sensors, rows, peaks = find_zone_peaks(labeled_array, zone_values)
+        keep = peaks > self.detection_threshold
+        self.parts.append((zones[keep] + first_zone, sensors[keep], rows[keep] + self.rows, peaks[keep],
+                           timestamps[rows[keep]]))
+        self.rows += len(zone_mask)
+
+    def patterns(self, min_pattern_length):
+        """The patterns of all rows added so far"""
+        if not self.parts:
+            return DetectedSequences()
+        zones, sensors, rows, peaks, timestamps = (np.concatenate(arrays) for arrays in zip(*self.parts))
+
+        # A merged zone is numbered after its first cell and keeps the earliest peak of every sensor
+        roots = np.array([self.find(zone) for zone in range(len(self.parent))], dtype=np.int64)
+        first_cells = np.array(self.first_cells, dtype=np.int64)
+        zone_order = np.full(len(roots), np.iinfo(np.int64).max)
+        np.minimum.at(zone_order, roots, first_cells)
+        zones = zone_order[roots[zones]]
+
+        entries = peak_entries(zones, sensors, rows, peaks)
+        zones, sensors, peaks, timestamps = zones[entries], sensors[entries], peaks[entries], timestamps[entries]
+        return group_zone_patterns(zones, sensors, np.arange(len(zones)), peaks, timestamps,
+                                   self.detection_threshold, min_pattern_length)
+
+def range_rows(starts, stops):
+    """All row indices of the ranges [start, stop) in order"""
+    lengths = stops - starts
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return offsets + np.arange(lengths.sum())
+
+def no_report(message, fraction=None):
+    pass
+
+
+class PatternDetector:
+    """Detects the patterns of one recording.
+
+    Every detector holds its own settings and data, so several can run side by side in
+    threads or processes. Call load() and detect() to find the patterns and export() to
+    write them to a .seq file.
+
+    The loaded recording and the zone peaks are kept between detections, so changing only
+    the detection threshold or minimum pattern length just filters the cached peaks, and a
+    new zone threshold only relabels the rows whose mask actually changes.
+    """
+
+    SETTINGS = ("visible_sensors", "detection_threshold", "zone_threshold", "min_pattern_length",
+                "distance_between_sensors", "start_seconds", "broken_sensors", "workers")
+
+    def __init__(self, input_file_path, visible_sensors=(1, 40), detection_threshold=100, zone_threshold=100,
+                 min_pattern_length=3, distance_between_sensors=25, start_seconds=0, broken_sensors=(), workers=None):
+        self.input_file_path = input_file_path
+        self.visible_sensors = visible_sensors
+        self.detection_threshold = detection_threshold
+        self.zone_threshold = zone_threshold
+        self.min_pattern_length = min_pattern_length
+        self.distance_between_sensors = distance_between_sensors
+        # Only whole seconds after this time are detected
+        self.start_seconds = start_seconds
+        # Sensors interpolated from their healthy neighbours before detection
+        self.broken_sensors = tuple(broken_sensors)
+        # Worker processes for long recordings, None uses every CPU and 1 disables the pool
+        self.workers = workers
+
+        self.streaming_file_size = STREAMING_FILE_SIZE
+        self.parallel_min_rows = PARALLEL_MIN_ROWS
+        # Relabel everything instead when a new zone threshold touches more of the rows than this
+        self.relabel_max_fraction = 0.5
+
+        self.timestamps = np.empty(0)
+        self.values = np.empty((0, 0))
+        self.mask = np.empty((0, 0), dtype=bool)
+        self.result = DetectedSequences()
+        self.clear_cache()
+
+    def clear_cache(self):
+        self.loaded_key = None
+        self.row_max = None
+        self.peaks = None
+        self.peaks_zone_threshold = None
+        # Flat cell indices sorted by value, built the first time the zone threshold changes
+        self.value_order = None
+        self.sorted_values = None
+
+    def update(self, **settings):
+        """Change some of the settings, the cached data is reused where it still applies"""
+        for name, value in settings.items():
+            if name not in self.SETTINGS:
+                raise TypeError(f"Unknown detection setting '{name}'")
+            setattr(self, name, tuple(value) if name == "broken_sensors" else value)
+
+    def sensor_columns(self):
+        """Columns of the visible sensors in the sensor matrix"""
+        return slice(int(round(self.visible_sensors[0])) - 1, int(round(self.visible_sensors[1])))
+
+    def load_key(self):
+        """What the loaded arrays depend on, including the version of the file on disk"""
+        stat = os.stat(self.input_file_path)
+        columns = self.sensor_columns()
+        return (self.input_file_path, stat.st_size, stat.st_mtime_ns, self.start_seconds, columns.start, columns.stop,
+                tuple(sorted(set(self.broken_sensors))))
+
+    def repair(self, sensor_values):
+        """Interpolate the broken sensors, sensor n being column n of the sensor matrix"""
+        broken_columns = [sensor for sensor in self.broken_sensors if 1 <= sensor < sensor_values.shape[1]]
+        if not broken_columns:
+            return sensor_values
+        return repair_broken_sensors(sensor_values, broken_columns, first_sensor_column=1)
+
+    def is_streamed(self):
+        return os.path.getsize(self.input_file_path) > self.streaming_file_size
+
+    def load(self):
+        """Load the visible sensors of the whole seconds after the start time"""
+        key = self.load_key()
+        self.clear_cache()
+
+        # Load the recording (parsed once, then served from the cache next to the file)
+        times, sensor_values = load_recording(self.input_file_path)
+
+        # Keep whole seconds after the start time
+        rows = (times > self.start_seconds) & (times == np.trunc(times))
+
+        # Separate the timestamps and the values, repair the broken sensors and keep only the visible ones
+        self.timestamps = np.asarray(times[rows])
+        self.values = np.ascontiguousarray(self.repair(np.asarray(sensor_values[rows]))[:, self.sensor_columns()])
+
+        # Create a mask where values are greater than the threshold
+        self.mask = self.values > self.zone_threshold
+        self.row_max = self.values.max(axis=1) if self.values.size else np.empty(0, dtype=self.values.dtype)
+        self.loaded_key = key
+
+    def detect(self, report=None, cancel_event=None):
+        """Find the patterns of the recording, safe to call from a worker thread"""
+        report = report or no_report
+
+        if self.is_streamed():
+            self.clear_cache()
+            self.result = self.detect_streaming(report=report, cancel_event=cancel_event)
+        else:
+            if self.loaded_key != self.load_key():
+                report("Loading recording", 0.0)
+                self.load()
+            check_cancelled(cancel_event)
+
+            if self.peaks is None or self.peaks_zone_threshold != self.zone_threshold:
+                report(f"Labelling zones in {len(self.timestamps)} seconds of data", 0.3)
+                self.update_zone_peaks(report, cancel_event)
+            check_cancelled(cancel_event)
+
+            self.result = group_zone_patterns(*self.peaks, self.timestamps, self.detection_threshold,
+                                              self.min_pattern_length)
+
+        report(f"Found {len(self.result)} patterns", 1.0)
+        return self.result
+
+    def summary(self):
+        """One line with the number of patterns per direction of the last detection"""
+        counts = self.result.direction_counts(self.distance_between_sensors)
+        return f"{len(self.result)} patterns: " + ", ".join(f"{count} {name.lower()}" for name, count in counts.items())
+
+    def update_zone_peaks(self, report=None, cancel_event=None):
+        """Bring the cached zone peaks in line with the current zone threshold"""
+        if self.peaks is None or not self.relabel_changed_rows():
+            # The mask, peaks and threshold only change together, once the labelling succeeded
+            mask = self.values > self.zone_threshold
+            if len(self.timestamps) >= self.parallel_min_rows:
+                peaks = parallel_zone_peaks(mask, self.values, self.workers, report, cancel_event)
+            else:
+                peaks = zone_peaks(mask, self.values)
+            self.mask = mask
+            self.peaks = peaks
+        self.peaks_zone_threshold = self.zone_threshold
+
+    def relabel_changed_rows(self):
+        """Relabel only the rows around cells that cross the zone threshold.
+
+        Rows where no value exceeds the lower of the old and new threshold are quiet in both
+        masks, so the rows between them are independent segments. Segments without a changed
+        cell keep their zones; the others are labelled again in one go. Returns False when
+        too much changed and a full relabel is cheaper.
+        """
+        old_threshold, new_threshold = self.peaks_zone_threshold, self.zone_threshold
+        low, high = min(old_threshold, new_threshold), max(old_threshold, new_threshold)
+
+        if self.value_order is None:
+            self.value_order = np.argsort(self.values, axis=None, kind='stable')
+            self.sorted_values = self.values.ravel()[self.value_order]
+
+        # Cells with low < value <= high are the only ones whose mask bit flips
+        first, last = np.searchsorted(self.sorted_values, [low, high], side='right')
+        changed = self.value_order[first:last]
+        if len(changed) == 0:
+            return True
+
+        total_rows = len(self.values)
+        cuts = np.flatnonzero(self.row_max <= low) + 1
+        bounds = np.unique(np.concatenate(([0], cuts, [total_rows])))
+        dirty = np.unique(np.searchsorted(bounds, changed // self.values.shape[1], side='right') - 1)
+        rows = range_rows(bounds[dirty], bounds[dirty + 1])
+        if len(rows) > self.relabel_max_fraction * total_rows:
+            return False
+
+        mask = self.mask.copy()
+        np.put(mask, changed, new_threshold < old_threshold)
+
+        # Each dirty segment ends on a row quiet in both masks, so stacking them keeps zones apart
+        new_zones, new_sensors, new_rows, new_peaks = zone_peaks(mask[rows], self.values[rows])
+        new_rows = rows[new_rows]
+
+        zones, sensors, old_rows, peaks = self.peaks
+        segments = np.searchsorted(bounds, old_rows, side='right') - 1
+        keep = ~np.isin(segments, dirty)
+
+        # Order the zones by segment, then by their order inside the segment, like one labelling would
+        segments = np.concatenate((segments[keep], np.searchsorted(bounds, new_rows, side='right') - 1))
+        zones = np.concatenate((zones[keep].astype(np.int64), new_zones.astype(np.int64)))
+        sensors = np.concatenate((sensors[keep], new_sensors))
+        all_rows = np.concatenate((old_rows[keep], new_rows))
+        peaks = np.concatenate((peaks[keep], new_peaks))
+
+        order = np.lexsort((sensors, zones, segments))
+        segments, zones, sensors, all_rows, peaks = (segments[order], zones[order], sensors[order],
+                                                     all_rows[order], peaks[order])
+        new_zone = np.ones(len(zones), dtype=bool)
+        new_zone[1:] = (segments[1:] != segments[:-1]) | (zones[1:] != zones[:-1])
+
+        self.mask = mask
+        self.peaks = (np.cumsum(new_zone), sensors, all_rows, peaks)
+        return True
+
+    def detect_streaming(self, block_rows=PARSE_BLOCK_ROWS, report=None, cancel_event=None):
+        """Detect patterns block by block so only one block of the recording is in memory.
+
+        Every block is labelled on its own and stitched to the previous one through their
+        seam row, see StreamedZones. The result is identical to a whole-file run.
+        """
+        zones = StreamedZones(self.detection_threshold)
+        columns = self.sensor_columns()
+
+        for block, (times, sensor_values) in enumerate(iter_recording_blocks(self.input_file_path, block_rows), start=1):
+            check_cancelled(cancel_event)
+            if report:
+                report(f"Detecting block {block}, {zones.count()} zones so far")
+
+            # Keep whole seconds after the start time, repair the broken sensors and keep only the visible ones
+            rows = (times > self.start_seconds) & (times == np.trunc(times))
+            block_values = self.repair(sensor_values[rows])[:, columns]
+            zones.add(block_values > self.zone_threshold, block_values, times[rows])
+
+        return zones.patterns(self.min_pattern_length)
+
+    def export(self, save_path):
+        """Write the detected patterns to a .seq file"""
+        save_sequences_file(self.result, self.distance_between_sensors, save_path)
+        return save_path
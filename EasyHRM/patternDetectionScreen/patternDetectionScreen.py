@@ -39,8 +39,24 @@ def open_screen_for_pattern_detection(root, go_back_func, create_main_screen_fun
     settings_label = ctk.CTkLabel(advanced_settings_frame, text="Advanced Settings", font=("Arial", 14, "bold"))
     settings_label.pack(pady=10)
 
+    # Cancel event of the detection running in the background, if any
+    detection = {}
+
+    def start_detection():
+        detection["cancel"] = compute_patterns(sliders, advanced_sliders, time_entries, broken_sensor_entries, settings_frame,
+                                               button_export, button_detect_events, button_cancel, progress_bar,
+                                               progress_label)
+
+    def cancel_detection():
+        if detection.get("cancel") is not None:
+            detection["cancel"].set()
+
+    def go_back():
+        cancel_detection()
+        go_back_func(root, create_main_screen_func)
+
     # Bottom Buttons
-    button_detect_events = ctk.CTkButton(main_frame, text="Detect Events", command=lambda: compute_patterns(sliders, advanced_sliders, time_entries, settings_frame, button_export), state='disabled')
+    button_detect_events = ctk.CTkButton(main_frame, text="Detect Events", command=start_detection, state='disabled')
     button_detect_events.grid(row=3, column=0, padx=10, pady=10, sticky="ew")
 
     button_approximate = ctk.CTkButton(main_frame, text="Approximate broken sensors", command=lambda: approximate_broken_sensor(broken_sensor_entries), state='disabled')
@@ -49,8 +65,19 @@ def open_screen_for_pattern_detection(root, go_back_func, create_main_screen_fun
     button_export = ctk.CTkButton(main_frame, text="Export", command=lambda: exportToXML(), state='disabled')
     button_export.grid(row=3, column=2, padx=10, pady=10, sticky="ew")
 
-    button_back = ctk.CTkButton(main_frame, text="Back", command=lambda: go_back_func(root, create_main_screen_func))
-    button_back.grid(row=4, column=0, columnspan=3, padx=10, pady=10, sticky="ew")
+    # Detection progress
+    progress_bar = ctk.CTkProgressBar(main_frame)
+    progress_bar.set(0)
+    progress_bar.grid(row=4, column=0, columnspan=2, padx=10, pady=10, sticky="ew")
+
+    button_cancel = ctk.CTkButton(main_frame, text="Cancel", command=cancel_detection, state='disabled')
+    button_cancel.grid(row=4, column=2, padx=10, pady=10, sticky="ew")
+
+    progress_label = ctk.CTkLabel(main_frame, text="", font=("Arial", 12))
+    progress_label.grid(row=5, column=0, columnspan=3, padx=10, sticky="ew")
+
+    button_back = ctk.CTkButton(main_frame, text="Back", command=go_back)
+    button_back.grid(row=6, column=0, columnspan=3, padx=10, pady=10, sticky="ew")
 
     # Configure grid weights for responsiveness
     main_frame.grid_columnconfigure(0, weight=1)
@@ -0,0 +1,188 @@
+import os
+import stat
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Number of text lines parsed at once, keeps the temporary int64/float64 copy small
+PARSE_BLOCK_ROWS = 200000
+
+
+def cache_path(path):
+    """Sidecar file next to the recording, keyed on the size and modification time of the text file"""
+    stat = os.stat(path)
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{name}.{stat.st_size}.{stat.st_mtime_ns}.npy")
+
+
+def compact_values(values):
+    """Store sensor values as int16 when they fit, falling back to int32 or float32"""
+    if values.size == 0:
+        return values.astype(np.int16)
+    if np.issubdtype(values.dtype, np.integer) or np.array_equal(values, np.round(values)):
+        low, high = values.min(), values.max()
+        for dtype in (np.int16, np.int32):
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                return values.astype(dtype)
+    return values.astype(np.float32)
+
+
+def iter_text_blocks(path, block_rows=PARSE_BLOCK_ROWS):
+    """Yield the time column and sensor matrix of a text export, block_rows lines at a time.
+
+    Lines whose time is not a number, such as a header line, are skipped.
+    """
+    reader = pd.read_csv(path, sep=r"\s+", header=None, chunksize=block_rows)
+    for block in reader:
+        times = pd.to_numeric(block.iloc[:, 0], errors='coerce').to_numpy(dtype=np.float64)
+        timed = ~np.isnan(times)
+        values = block.iloc[:, 1:]
+        if not timed.all():
+            values = values[timed].apply(pd.to_numeric, errors='coerce')
+        yield times[timed], compact_values(values.to_numpy())
+
+
+def iter_recording_blocks(path, block_rows=PARSE_BLOCK_ROWS):
+    """Yield a recording block by block, from the cached sidecar when there is one.
+
+    Only one block is held in memory at a time, so this works for recordings larger than RAM.
+    """
+    sidecar = cache_path(path)
+    if os.path.exists(sidecar):
+        try:
+            records = np.load(sidecar, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            print(f"Could not read cached recording {sidecar}: {e}")
+        else:
+            for start in range(0, len(records), block_rows):
+                block = records[start:start + block_rows]
+                yield np.asarray(block['time']), np.asarray(block['values'])
+            return
+
+    yield from iter_text_blocks(path, block_rows)
+
+
+def parse_recording(path):
+    """Parse a whitespace separated plotHRM text export into a time column and a sensor matrix"""
+    times = []
+    values = []
+    for block_times, block_values in iter_text_blocks(path):
+        times.append(block_times)
+        values.append(block_values)
+
+    if not times:
+        return np.empty(0, dtype=np.float64), np.empty((0, 0), dtype=np.int16)
+
+    value_dtype = np.result_type(*[block.dtype for block in values])
+    return np.concatenate(times), np.concatenate(values).astype(value_dtype, copy=False)
+
+
+def write_cache(path, times, values):
+    """Save the parsed recording as one memory-mappable record array and drop stale sidecars"""
+    sidecar = cache_path(path)
+    directory, name = os.path.split(sidecar)
+    prefix = f".{os.path.basename(path)}."
+
+    records = np.empty(len(times), dtype=[('time', np.float64), ('values', values.dtype, (values.shape[1],))])
+    records['time'] = times
+    records['values'] = values
+
+    # Every writer gets its own temporary file, so processes caching the same recording never mix
+    file = tempfile.NamedTemporaryFile(dir=directory, prefix=f"{name}.", suffix=".tmp", delete=False)
+    try:
+        with file:
+            np.save(file, records)
+        # Temporary files are private, the cache is as readable as the recording it belongs to
+        os.chmod(file.name, stat.S_IMODE(os.stat(path).st_mode) & 0o666)
+        os.replace(file.name, sidecar)
+    except BaseException:
+        os.remove(file.name)
+        raise
+
+    for other in os.listdir(directory):
+        if other.startswith(prefix) and other.endswith(".npy") and other != name:
+            os.remove(os.path.join(directory, other))
+
+
+def load_recording(path, use_cache=True):
+    """Return the time column and sensor matrix of a recording.
+
+    The text file is only parsed the first time; later loads memory-map the cached sidecar.
+    """
+    if use_cache:
+        sidecar = cache_path(path)
+        if os.path.exists(sidecar):
+            try:
+                records = np.load(sidecar, mmap_mode='r')
+                return records['time'], records['values']
+            except (OSError, ValueError) as e:
+                print(f"Could not read cached recording {sidecar}: {e}")
+
+    times, values = parse_recording(path)
+
+    if use_cache:
+        try:
+            write_cache(path, times, values)
+        except OSError as e:
+            print(f"Could not cache recording next to {path}: {e}")
+
+    return times, values
+
+
+def repair_broken_sensors(values, broken_columns, first_sensor_column=0):
+    """Return a copy of the sensor matrix with the broken columns interpolated.
+
+    Every broken column gets the linear interpolation between the nearest healthy sensor
+    column on each side, so runs of adjacent broken sensors are filled as well. At the
+    ends of the catheter the nearest healthy sensor is copied. Columns before
+    first_sensor_column are not sensors and are never used.
+    """
+    total_columns = values.shape[1]
+    broken = np.zeros(total_columns, dtype=bool)
+    broken[:first_sensor_column] = True
+    broken[list(broken_columns)] = True
+
+    healthy = np.flatnonzero(~broken)
+    broken_columns = np.array(sorted(set(broken_columns)), dtype=np.int64)
+    repaired = np.array(values)
+    if len(broken_columns) == 0 or len(healthy) == 0:
+        return repaired
+
+    # Nearest healthy column on each side, falling back to the other side at the ends
+    positions = np.searchsorted(healthy, broken_columns)
+    left = healthy[np.maximum(positions - 1, 0)]
+    right = healthy[np.minimum(positions, len(healthy) - 1)]
+    left = np.where(positions == 0, right, left)
+    right = np.where(positions == len(healthy), left, right)
+
+    left_values = values[:, left].astype(np.float64)
+    right_values = values[:, right].astype(np.float64)
+    span = np.maximum(right - left, 1)
+    interpolated = (left_values * (right - broken_columns) + right_values * (broken_columns - left)) / span
+    interpolated = np.where(right == left, left_values, interpolated)
+
+    if np.issubdtype(values.dtype, np.integer):
+        interpolated = np.round(interpolated)
+    repaired[:, broken_columns] = interpolated.astype(values.dtype)
+    return repaired
+
+
+def format_times(times):
+    """Write whole seconds without decimals and other samples with one decimal, like plotHRM"""
+    return ["%d" % time if time.is_integer() else "%.1f" % time for time in np.asarray(times, dtype=np.float64).tolist()]
+
+
+def write_recording(path, times, values, first_separator="\t\t ", separator="\t ", time_strings=None,
+                    block_rows=PARSE_BLOCK_ROWS):
+    """Write a recording back to a whitespace separated text file, block_rows lines at a time"""
+    if time_strings is None:
+        time_strings = format_times(times)
+    value_format = "%d" if np.issubdtype(values.dtype, np.integer) else "%g"
+    line_format = "%s" + first_separator + separator.join([value_format] * values.shape[1]) + "\n"
+
+    with open(path, 'w') as file:
+        for start in range(0, len(times), block_rows):
+            stop = start + block_rows
+            rows = zip(time_strings[start:stop], *np.asarray(values[start:stop]).T.tolist())
+            file.write("".join(line_format % row for row in rows))
@@ -0,0 +1,78 @@
+import numpy as np
+
+REGIONS = ["Ascending", "Transverse", "Descending", "Sigmoid", "Rectum"]
+
+
+class RegionMap:
+    """Colon regions of the sensors, built once from the region slider values.
+
+    Sensors are numbered from 1; sensor 0 stands for "no active sensor" in the lookups.
+    Disabled regions are left out of every lookup except the raw slider_values.
+    """
+
+    def __init__(self, slider_values, disabled_sections=()):
+        self.slider_values = [tuple(values) for values in slider_values]
+        enabled = [i for i, region in enumerate(REGIONS)
+                   if region not in disabled_sections and i < len(self.slider_values)]
+        self.names = [REGIONS[i] for i in enabled]
+        self.region_ids = np.array(enabled, dtype=np.int64)
+        self.starts = np.array([self.slider_values[i][0] for i in enabled], dtype=np.int64)
+        self.ends = np.array([self.slider_values[i][1] for i in enabled], dtype=np.int64)
+
+        # Lookups for sensors 0 to size - 1; every sensor above shares the last entry
+        size = max([0, *self.starts, *self.ends]) + 2
+        sensors = np.arange(size)
+        self.sensor_region = np.full(size, -1, dtype=np.int64)
+        for i in range(len(self.names) - 1, -1, -1):
+            self.sensor_region[(self.starts[i] <= sensors) & (sensors <= self.ends[i])] = i
+        self.sensor_region[0] = -1
+
+        if self.names:
+            self.first_region = self.fallback_first_region(sensors)
+            self.last_region = self.fallback_last_region(sensors)
+
+    def fallback_first_region(self, sensors):
+        """Region a pattern starting at each sensor starts in, the first region if it has no active sensor"""
+        index = np.zeros(len(sensors), dtype=np.int64)
+        for i, start in enumerate(self.starts):
+            index[sensors >= start] = i
+        index[sensors < self.starts[0]] = 0
+        inside = self.sensor_region >= 0
+        index[inside] = self.sensor_region[inside]
+        index[0] = 0
+        return index
+
+    def fallback_last_region(self, sensors):
+        """Region a pattern ending at each sensor ends in, the last region if it has no active sensor"""
+        last = len(self.names) - 1
+        index = np.full(len(sensors), last, dtype=np.int64)
+        for i in range(last, -1, -1):
+            index[sensors <= self.ends[i]] = i
+        index[sensors > self.ends[last]] = last
+        inside = self.sensor_region >= 0
+        index[inside] = self.sensor_region[inside]
+        index[0] = last
+        return index
+
+    def lookup(self, table, sensors):
+        return table[np.clip(np.asarray(sensors, dtype=np.int64), 0, len(table) - 1)]
+
+    def region_of(self, sensors):
+        """Index in names of the region holding each sensor, -1 outside every region"""
+        return self.lookup(self.sensor_region, sensors)
+
+    def starting_regions(self, first_sensor):
+        """Region names of patterns whose first active sensor is first_sensor (0 for none)"""
+        if not self.names:
+            return np.full(len(first_sensor), "Ascending", dtype=object)
+        return np.array(self.names, dtype=object)[self.lookup(self.first_region, first_sensor)]
+
+    def ending_regions(self, last_sensor):
+        """Region names of patterns whose last active sensor is last_sensor (0 for none)"""
+        if not self.names:
+            return np.full(len(last_sensor), "Rectum", dtype=object)
+        return np.array(self.names, dtype=object)[self.lookup(self.last_region, last_sensor)]
+
+    def bounds(self):
+        """(name, first sensor, last sensor) of every enabled region"""
+        return list(zip(self.names, self.starts.tolist(), self.ends.tolist()))
@@ -0,0 +1,103 @@
+import numpy as np
+
+# Direction codes, the sign of the velocity
+SYNCHRONOUS = 0
+ANTEGRADE = 1
+RETROGRADE = -1
+DIRECTION_NAMES = {ANTEGRADE: 'Antegrade', RETROGRADE: 'Retrograde', SYNCHRONOUS: 'Synchronous'}
+
+
+def sequence_kinematics(start_sample, end_sample, start_channel, end_channel, distance_between_sensors):
+    """Velocity (mm/s) and direction code of every sequence.
+
+    Sequences without duration get an infinite velocity and are synchronous, as are
+    sequences slower than 1 mm/s in either direction.
+    """
+    duration = np.asarray(end_sample, dtype=np.int64) - np.asarray(start_sample, dtype=np.int64)
+    travelled = (np.asarray(end_channel, dtype=np.int64) - np.asarray(start_channel, dtype=np.int64)) * distance_between_sensors
+
+    velocity = np.full(len(duration), np.inf)
+    moving = duration != 0
+    velocity[moving] = travelled[moving] / (duration[moving] / 10)
+
+    direction = np.full(len(duration), SYNCHRONOUS, dtype=np.int8)
+    whole_velocity = np.trunc(velocity[moving])
+    direction[moving] = np.sign(whole_velocity).astype(np.int8)
+    return velocity, direction
+
+
+def format_velocity(velocity):
+    return "INF" if np.isinf(velocity) else str(velocity)
+
+
+class DetectedSequences:
+    """Detected patterns stored column-wise.
+
+    Every peak of every pattern is one entry of the sample, channel and value arrays, and
+    the entries of sequence i are offsets[i]:offsets[i + 1]. Samples are in deciseconds and
+    channels use the plotHRM numbering (sensor_N is channel N - 2), like the .seq file.
+    """
+
+    __slots__ = ("sample", "channel", "value", "offsets", "cached_kinematics")
+
+    def __init__(self, sample=None, channel=None, value=None, offsets=None):
+        self.sample = np.empty(0, dtype=np.int64) if sample is None else np.asarray(sample, dtype=np.int64)
+        self.channel = np.empty(0, dtype=np.int64) if channel is None else np.asarray(channel, dtype=np.int64)
+        self.value = np.empty(0, dtype=np.int64) if value is None else np.asarray(value)
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else np.asarray(offsets, dtype=np.int64)
+        self.cached_kinematics = None
+
+    @classmethod
+    def from_peaks(cls, timestamps, sensors, values, lengths):
+        """Build from per-peak timestamps (seconds), sensor columns and values plus the length of every sequence"""
+        samples = np.trunc(np.asarray(timestamps, dtype=np.float64) * 10)
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        # sensor + 1 is the sensor_id starting from 1, the plotHRM channel is two lower
+        return cls(samples, np.asarray(sensors) - 1, values, offsets)
+
+    @classmethod
+    def from_patterns(cls, patterns):
+        """Build from the older list of [(timestamp, 'sensor_N', value), ...] patterns"""
+        entries = [entry for pattern in patterns for entry in pattern]
+        return cls(
+            [int(timestamp * 10) for timestamp, sensor, value in entries],
+            [int(sensor.split('_')[1]) - 2 for timestamp, sensor, value in entries],
+            np.array([value for timestamp, sensor, value in entries]),
+            np.concatenate(([0], np.cumsum([len(pattern) for pattern in patterns], dtype=np.int64))),
+        )
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def start_sample(self):
+        return self.sample[self.offsets[:-1]]
+
+    def end_sample(self):
+        return self.sample[self.offsets[1:] - 1]
+
+    def start_channel(self):
+        return self.channel[self.offsets[:-1]]
+
+    def end_channel(self):
+        return self.channel[self.offsets[1:] - 1]
+
+    def kinematics(self, distance_between_sensors):
+        """Velocity and direction arrays of all sequences, computed once per sensor distance"""
+        if self.cached_kinematics is None or self.cached_kinematics[0] != distance_between_sensors:
+            velocity, direction = sequence_kinematics(self.start_sample(), self.end_sample(), self.start_channel(),
+                                                      self.end_channel(), distance_between_sensors)
+            self.cached_kinematics = (distance_between_sensors, velocity, direction)
+        return self.cached_kinematics[1:]
+
+    def direction_counts(self, distance_between_sensors):
+        direction = self.kinematics(distance_between_sensors)[1]
+        return {name: int(np.count_nonzero(direction == code)) for code, name in DIRECTION_NAMES.items()}
+
+    def to_patterns(self):
+        """The older list of [(timestamp, 'sensor_N', value), ...] patterns"""
+        samples, channels, values = self.sample.tolist(), self.channel.tolist(), self.value.tolist()
+        return [[(samples[i] / 10, f'sensor_{channels[i] + 2}', values[i]) for i in range(start, stop)]
+                for start, stop in zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist())]
@@ -0,0 +1,42 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from patternDetectionScreen.detector import PatternDetector, StreamedZones
+
+
+def write_recording(path, values):
+    with open(path, "w") as file:
+        for row, sensor_values in enumerate(values):
+            file.write(f"{row / 10:.1f} " + " ".join(map(str, sensor_values)) + "\n")
+
+
+def test_streaming_without_quiet_rows_keeps_blocks_bounded(tmp_path, monkeypatch):
+    # Sensor 6 never drops below the zone threshold, so no row of the recording is quiet
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 200, size=(3000, 41))
+    values[:, 5] = 150
+    path = tmp_path / "stuck.txt"
+    write_recording(path, values)
+
+    block_rows = 100
+    labelled_rows = []
+    add = StreamedZones.add
+
+    def recording_add(self, zone_mask, zone_values, timestamps):
+        labelled_rows.append(len(zone_mask))
+        add(self, zone_mask, zone_values, timestamps)
+        # Only the seam row is kept between blocks
+        assert self.seam.shape == (zone_mask.shape[1],)
+
+    monkeypatch.setattr(StreamedZones, "add", recording_add)
+
+    detector = PatternDetector(str(path), zone_threshold=100, detection_threshold=120, min_pattern_length=2)
+    whole = detector.detect()
+    streamed = detector.detect_streaming(block_rows=block_rows)
+
+    assert max(labelled_rows) <= block_rows
+    assert len(labelled_rows) == 3000 // block_rows
+    assert streamed.to_patterns() == whole.to_patterns()
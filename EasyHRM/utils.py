@@ -1,8 +1,12 @@
 import os
+import queue
+import threading
 from tkinter import filedialog, messagebox
 import customtkinter as ctk
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
+import io
+from xml.sax.saxutils import escape
+import numpy as np
+from sequences import DetectedSequences, sequence_kinematics, format_velocity, DIRECTION_NAMES
 
 global filename
 global file_path
@@ -73,6 +77,54 @@ def convertTimeToText(input):
 
     return time_format
 
+class TaskCancelled(Exception):
+    """Raised inside a background task when the user pressed Cancel"""
+
+# How often the Tk main loop picks up progress from a background task
+BACKGROUND_POLL_MS = 100
+
+def check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise TaskCancelled()
+
+def run_in_background(root, work, on_progress, on_done, on_error):
+    """Run work(report, cancel_event) on a worker thread and hand its outcome back to Tk.
+
+    work reports progress with report(message, fraction), where fraction is None when the
+    amount of work is unknown. All callbacks run on the Tk main loop; a cancelled task ends
+    in on_error with a TaskCancelled exception. Returns the event that cancels the task.
+    """
+    updates = queue.Queue()
+    cancel_event = threading.Event()
+
+    def report(message, fraction=None):
+        updates.put(("progress", (message, fraction)))
+
+    def worker():
+        try:
+            updates.put(("done", work(report, cancel_event)))
+        except Exception as e:
+            updates.put(("error", e))
+
+    def poll():
+        try:
+            while True:
+                kind, payload = updates.get_nowait()
+                if kind == "progress":
+                    on_progress(*payload)
+                elif kind == "done":
+                    on_done(payload)
+                    return
+                else:
+                    on_error(payload)
+                    return
+        except queue.Empty:
+            root.after(BACKGROUND_POLL_MS, poll)
+
+    threading.Thread(target=worker, daemon=True).start()
+    root.after(BACKGROUND_POLL_MS, poll)
+    return cancel_event
+
 def show_info_popup(title, message, root):
     # Create a popup window
     popup = ctk.CTkToplevel()
@@ -108,85 +160,121 @@ def show_info_popup(title, message, root):
     close_button.pack(pady=10)
 
 def process_sequences(data):
-    sequences = []
-
-    for sequence in data:
-        # Extract start and end samples
-        start_sample = sequence[0][0]
-        end_sample = sequence[-1][0]
-
-        # Extract start and end sensors (channels)
-        start_sensor = sequence[0][1]
-        end_sensor = sequence[-1][1]
-
-        # Create a new sequence dictionary
-        seq_dict = {
-            "startSample": int(start_sample * 10),
-            "endSample": int(end_sample * 10),
-            "startChannel": int(start_sensor.split('_')[1]) - 2,
-            "endChannel": int(end_sensor.split('_')[1]) - 2,
-            "ranges": []
+    return list(iter_sequences(data))
+
+def as_detected_sequences(data):
+    """Accept both DetectedSequences and the older list of [(timestamp, 'sensor_N', value), ...] patterns"""
+    return data if isinstance(data, DetectedSequences) else DetectedSequences.from_patterns(data)
+
+def iter_sequence_records(data):
+    """Yield (startSample, endSample, startChannel, endChannel, ranges) per sequence, ranges being
+    (startSample, endSample, channel, maxSample, maxValue) tuples"""
+    data = as_detected_sequences(data)
+    samples = data.sample.tolist()
+    channels = data.channel.tolist()
+    values = data.value.astype(np.int64).tolist()
+    offsets = data.offsets.tolist()
+
+    for start, stop in zip(offsets[:-1], offsets[1:]):
+        start_sample, end_sample = samples[start], samples[stop - 1]
+        ranges = [(start_sample, end_sample, channels[i], samples[i], values[i]) for i in range(start, stop)]
+        yield start_sample, end_sample, channels[start], channels[stop - 1], ranges
+
+def iter_sequences(data):
+    """Yield the .seq dictionary of every detected pattern, one at a time"""
+    for start_sample, end_sample, start_channel, end_channel, ranges in iter_sequence_records(data):
+        yield {
+            "startSample": start_sample,
+            "endSample": end_sample,
+            "startChannel": start_channel,
+            "endChannel": end_channel,
+            "ranges": [{
+                "startSample": range_start,
+                "endSample": range_end,
+                "channel": channel,
+                "maxSample": max_sample,
+                "maxValue": max_value
+            } for range_start, range_end, channel, max_sample, max_value in ranges]
         }
 
-        # Add range data
-        for entry in sequence:
-            sensor_value = entry[2]
-            sample, sensor, _ = entry
-            channel = int(sensor.split('_')[1]) -2
-            seq_dict["ranges"].append({
-                "startSample": int(start_sample * 10),
-                "endSample": int(end_sample * 10),
-                "channel": channel,
-                "maxSample": int(sample * 10),
-                "maxValue": int(sensor_value)
-            })
+def dict_sequence_records(sequences):
+    for seq in sequences:
+        yield (seq["startSample"], seq["endSample"], seq["startChannel"], seq["endChannel"],
+               [(r["startSample"], r["endSample"], r["channel"], r["maxSample"], r["maxValue"]) for r in seq["ranges"]])
 
-        sequences.append(seq_dict)
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+XML_INDENT = "    "
 
-    return sequences
+def xml_attributes(attributes):
+    return "".join(f' {name}="{escape(str(value), {chr(34): "&quot;"})}"' for name, value in attributes)
 
-def sequences_to_xml(sequences, distance_between_sensors):
-    root = ET.Element("sequences")
+def with_kinematics(record, distance_between_sensors):
+    velocity, direction = sequence_kinematics([record[0]], [record[1]], [record[2]], [record[3]], distance_between_sensors)
+    return record, velocity[0], direction[0]
 
-    for seq in sequences:
-        time = int((seq["endSample"]) - int(seq["startSample"]))
-        if (time == 0):
-            velocity = "INF"
-            dir = 'Synchronous'
+def write_sequences_xml(file, sequences, distance_between_sensors):
+    """Write the <sequences> document to an open text file, indented like plotHRM expects.
+
+    sequences is a DetectedSequences or any iterable of .seq dictionaries, including a
+    generator, so the document is never held in memory.
+    """
+    if isinstance(sequences, DetectedSequences):
+        velocity, direction = sequences.kinematics(distance_between_sensors)
+        records = zip(iter_sequence_records(sequences), velocity.tolist(), direction.tolist())
+    else:
+        records = (with_kinematics(record, distance_between_sensors) for record in dict_sequence_records(sequences))
+
+    empty = True
+    for (start_sample, end_sample, start_channel, end_channel, ranges), velocity, direction in records:
+        if empty:
+            file.write("<sequences>\n")
+            empty = False
+
+        lines = [XML_INDENT + "<sequence" + xml_attributes([
+            ("dir", DIRECTION_NAMES[direction]),
+            ("vel", format_velocity(velocity)),
+            ("startSample", start_sample),
+            ("endSample", end_sample),
+            ("startChannel", start_channel),
+            ("endChannel", end_channel),
+        ])]
+        if not ranges:
+            lines[0] += "/>\n"
         else:
-            velocity = ((int(seq["endChannel"]) - int(seq["startChannel"])) * distance_between_sensors ) / (time / 10)
-            if int(velocity) > 0:
-                dir = 'Antegrade'
-            elif int(velocity) < 0:
-                dir = 'Retrograde'
-            elif(int(velocity) == 0):
-                dir = 'Synchronous'
-
-        seq_elem = ET.SubElement(root, "sequence", {
-            "dir": dir,
-            "vel": str(velocity),
-            "startSample": str(seq["startSample"]),
-            "endSample": str(seq["endSample"]),
-            "startChannel": str(seq["startChannel"]),
-            "endChannel": str(seq["endChannel"])
-        })
-
-        for r in seq["ranges"]:
-            ET.SubElement(seq_elem, "range", {
-                "startSample": str(r["startSample"]),
-                "endSample": str(r["endSample"]),
-                "channel": str(r["channel"]),
-                "maxSample": str(r["maxSample"]),
-                "maxValue": str(r["maxValue"])
-            })
-
-    xml_str = minidom.parseString(ET.tostring(root, encoding='utf-8')).toprettyxml(indent="    ")
-    return xml_str.split('\n', 1)[-1]  # Remove the first line which contains the redundant XML declaration
+            lines[0] += ">\n"
+            for range_start, range_end, channel, max_sample, max_value in ranges:
+                lines.append(XML_INDENT * 2 + "<range" + xml_attributes([
+                    ("startSample", range_start),
+                    ("endSample", range_end),
+                    ("channel", channel),
+                    ("maxSample", max_sample),
+                    ("maxValue", max_value),
+                ]) + "/>\n")
+            lines.append(XML_INDENT + "</sequence>\n")
+        file.write("".join(lines))
+    file.write("<sequences/>\n" if empty else "</sequences>\n")
 
-def write_xml_to_file(xml_output, filename):
+def sequences_to_xml(sequences, distance_between_sensors):
+    output = io.StringIO()
+    write_sequences_xml(output, sequences, distance_between_sensors)
+    return output.getvalue()
+
+def ask_sequences_save_path(filename):
     filename = filename.split('.')[0]
-    save_path = filedialog.asksaveasfilename(defaultextension=".seq", filetypes=[("Sequences files", "*.seq")], initialfile = f"{filename.split('.seq')[0]}_detected.seq")
+    return filedialog.asksaveasfilename(defaultextension=".seq", filetypes=[("Sequences files", "*.seq")], initialfile = f"{filename.split('.seq')[0]}_detected.seq")
+
+def write_xml_to_file(xml_output, filename):
+    save_path = ask_sequences_save_path(filename)
+    save_xml_file(xml_output, save_path)
+    print("XML file 'hrm_output' has been created.")
+
+def save_xml_file(xml_output, save_path):
     with open(save_path, 'w', encoding='utf-8') as file:
-        file.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n')
+        file.write(XML_DECLARATION)
         file.write(xml_output)
-        print("XML file 'hrm_output' has been created.")
+
+def save_sequences_file(sequences, distance_between_sensors, save_path):
+    """Stream the sequences straight into a .seq file"""
+    with open(save_path, 'w', encoding='utf-8', buffering=1024 * 1024) as file:
+        file.write(XML_DECLARATION)
+        write_sequences_xml(file, sequences, distance_between_sensors)